@@ -1,19 +1,35 @@
 #!/usr/bin/env python3
 import argparse
-import colorsys
+import asyncio
+import collections
+import errno
+import hashlib
+import inspect
 import json
 import logging
 import math
+import mmap
+import multiprocessing
+import os
 import queue
+import re
 import socket
+import struct
 import threading
 import time
+import tracemalloc
+from multiprocessing import shared_memory
 
-from paho import mqtt
 import paho.mqtt.client as mqtt_client
-import neopixel
+import numpy as np
 import webcolors
 
+try:
+    import neopixel
+except ImportError:
+    # only needed on the Pi itself, see NeoPixelBackend
+    neopixel = None
+
 logging.basicConfig(level=logging.DEBUG)
 
 logger = logging.getLogger(__name__)
@@ -21,10 +37,23 @@ logger = logging.getLogger(__name__)
 port = 2812
 pixels = 776
 preset_path = "/data/g1leds/presets"
+zone_path = "/data/g1leds/zones.json"
 
 brightness_pct = 100
+gamma = 1.0
+# per-channel lookup applied at render time, None when it would be a no-op
+colour_lut = None
+
+render_condition = threading.Condition()
+# extra callbacks run by notify_render(), e.g. to wake an event loop
+render_listeners = []
 
-show_event = threading.Event()
+
+def notify_render():
+    """Wake anything waiting to render. Call with render_condition held."""
+    render_condition.notify_all()
+    for listener in render_listeners:
+        listener()
 
 
 def parse_colour(name):
@@ -47,13 +76,395 @@ def parse_colour(name):
 def rgb_to_24bit(red, green, blue, white=0):
     """Convert the provided red, green, blue color to a 24-bit color value.
     Each color component should be a value 0-255 where 0 is the lowest intensity
-    and 255 is the highest intensity.
+    and 255 is the highest intensity. Brightness is applied later, by the
+    renderer, so always pass full intensity colours.
     """
     # return (white << 24) | (red << 16)| (green << 8) | blue
-    return (int(white * (brightness_pct/100)) << 24) \
-        | (int(green * (brightness_pct/100)) << 16) \
-        | (int(red * (brightness_pct/100)) << 8) \
-        | int(blue * (brightness_pct/100))
+    return (int(white) << 24) | (int(green) << 16) | (int(red) << 8) | int(blue)
+
+
+def rgb_array_to_24bit(red, green, blue):
+    """Vectorised rgb_to_24bit for integer arrays of red, green and blue."""
+    return (green.astype(np.uint32) << 16) \
+        | (red.astype(np.uint32) << 8) \
+        | blue.astype(np.uint32)
+
+
+def build_colour_lut(brightness, gamma=1.0):
+    """Build the 256 entry table applied to every colour channel at render time.
+
+    Returns None if the table would leave colours unchanged.
+    """
+    if brightness == 100 and gamma == 1.0:
+        return None
+    levels = np.arange(256)
+    if gamma != 1.0:
+        levels = (levels/255) ** gamma * 255
+    return (levels * (brightness/100)).astype(np.uint8)
+
+
+def set_brightness(brightness, new_gamma=None):
+    """Change global brightness (and optionally gamma) from the next frame on."""
+    global brightness_pct, gamma, colour_lut
+    with render_condition:
+        brightness_pct = brightness
+        if new_gamma is not None:
+            gamma = new_gamma
+        colour_lut = build_colour_lut(brightness_pct, gamma)
+        notify_render()
+
+
+def correct_colours(colours):
+    """Apply colour_lut to each byte of an array of 24-bit colours."""
+    lut = colour_lut
+    if lut is None:
+        return colours
+    return lut[colours.view(np.uint8)].view(np.uint32)
+
+
+def decode_rgb(data):
+    """Convert a buffer of packed red, green, blue bytes to 24-bit colours.
+
+    Trailing bytes that don't make up a whole pixel are ignored.
+    """
+    rgb = np.frombuffer(data, dtype=np.uint8, count=len(data) // 3 * 3).reshape(-1, 3)
+    return rgb_array_to_24bit(rgb[:, 0], rgb[:, 1], rgb[:, 2])
+
+
+def encode_rgb(colours, out):
+    """Write 24-bit colours into out, an (n, 3) array of red, green, blue bytes."""
+    channels = colours.view(np.uint8).reshape(-1, 4)
+    out[:, 0] = channels[:, 1]
+    out[:, 1] = channels[:, 2]
+    out[:, 2] = channels[:, 0]
+
+
+blend_modes = {
+    'over': lambda dst, src: src,
+    'add': lambda dst, src: np.minimum(dst + src, 255),
+    'max': np.maximum,
+    'multiply': lambda dst, src: dst * src / 255,
+}
+
+
+def upload(strip, colours, start=0):
+    """Write an array of colours to the strip starting at pixel start.
+
+    Uses a single slice assignment into the rpi_ws281x LED array where the
+    driver exposes one, falling back to setPixelColor per pixel.
+    """
+    values = colours.tolist()
+    led_data = getattr(strip, '_led_data', None)
+    if led_data is not None:
+        led_data[start:start + len(values)] = values
+    else:
+        for i, colour in enumerate(values, start):
+            strip.setPixelColor(i, colour)
+
+
+class RainbowEngine:
+    """Precomputed rainbow frames, shared by the rainbow family of programs.
+
+    Each of the 360 hue steps is built once as a whole frame of 24-bit
+    colours, using the same arithmetic as colorsys.hsv_to_rgb and
+    rgb_to_24bit so output is pixel-identical to the per-pixel version, and
+    later cycles are served straight from a table. There is a table for each
+    speed, multiplier and divisor in use, and those beyond max_bytes are
+    dropped least recently used first, always keeping the latest. shared()
+    hands out one engine per frame size, so every program of that size, and
+    every preset switch between them, reuses the same tables.
+    """
+    max_bytes = 16 * 1024 * 1024
+    engines = {}
+
+    def __init__(self, pixel_count):
+        self.pixel_count = pixel_count
+        self.pixel_index = np.arange(pixel_count)
+        self.tables = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, pixel_count):
+        """The engine for frames of pixel_count pixels, created on first use."""
+        try:
+            return cls.engines[pixel_count]
+        except KeyError:
+            return cls.engines.setdefault(pixel_count, cls(pixel_count))
+
+    def table(self, key):
+        """(table, built) arrays for key, made if need be."""
+        with self.lock:
+            try:
+                self.tables.move_to_end(key)
+                return self.tables[key]
+            except KeyError:
+                pass
+            self.tables[key] = (np.zeros((360, self.pixel_count), dtype=np.uint32),
+                                np.zeros(360, dtype=bool))
+            while (len(self.tables) > 1 and
+                   len(self.tables) * 360 * self.pixel_count * 4 > self.max_bytes):
+                # programs still holding a dropped table keep it until they let go
+                self.tables.popitem(last=False)
+            return self.tables[key]
+
+    def row(self, hue, speed=1, multiplier=2, divisor=1):
+        table, built = self.table((speed, multiplier, divisor))
+        if not built[hue]:
+            # another thread may build the same row at once, to the same colours
+            scaling = 360.0/self.pixel_count * multiplier
+            hues = ((hue*speed) + (self.pixel_index*scaling)) % 360
+            table[hue] = self.colours(hues, divisor)
+            built[hue] = True
+        return table[hue]
+
+    @staticmethod
+    def colours(hues, divisor=1):
+        # colorsys.hsv_to_rgb(h, 1.0, 1.0) with s and v folded in
+        h6 = (hues/360.0) * 6.0
+        i = h6.astype(np.int64)
+        f = h6 - i
+        v = np.ones_like(f)
+        p = np.zeros_like(f)
+        q = 1.0 - f
+        t = 1.0 - (1.0 - f)
+        sextant = [i % 6 == n for n in range(6)]
+        r = np.select(sextant, [v, q, p, p, t, v])
+        g = np.select(sextant, [t, v, v, q, p, p])
+        b = np.select(sextant, [p, p, t, v, v, q])
+        return rgb_array_to_24bit((r*255/divisor).astype(np.int64),
+                                  (g*255/divisor).astype(np.int64),
+                                  (b*255/divisor).astype(np.int64))
+
+
+class FrameClock:
+    """Paces frames against absolute time.monotonic() deadlines.
+
+    Each deadline is the previous one plus the interval, so the time a
+    program spends drawing doesn't stretch its frame period. A frame that
+    misses its deadline is counted as an overrun and the schedule restarts
+    from now rather than bursting to catch up.
+    """
+    def __init__(self, window=100):
+        self.deadline = None
+        self.frames = 0
+        self.overruns = 0
+        self.times = collections.deque(maxlen=window)
+
+    def reset(self):
+        self.deadline = None
+        self.times.clear()
+
+    def next_deadline(self, interval):
+        now = time.monotonic()
+        self.frames += 1
+        self.times.append(now)
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += interval
+        if self.deadline < now:
+            self.overruns += 1
+            self.deadline = now
+        return self.deadline
+
+    def fps(self):
+        if len(self.times) < 2 or self.times[-1] == self.times[0]:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def stats(self):
+        return {'fps': self.fps(), 'frames': self.frames, 'overruns': self.overruns}
+
+
+class SensorInputs:
+    """Latest value of each MQTT sensor topic that programs have asked for.
+
+    Topics are subscribed once on the main client, and again on reconnect,
+    and programs read the cached value without blocking.
+    """
+    def __init__(self):
+        self.client = None
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic):
+        with self.lock:
+            if topic in self.values:
+                return
+            self.values[topic] = None
+            client = self.client
+        if client is not None:
+            client.subscribe(topic)
+
+    def connected(self, client):
+        with self.lock:
+            self.client = client
+            topics = list(self.values)
+        for topic in topics:
+            client.subscribe(topic)
+
+    def update(self, topic, payload):
+        """Cache payload if topic is a sensor topic, returning True if it was."""
+        if topic not in self.values:
+            return False
+        self.values[topic] = payload.decode('utf-8')
+        return True
+
+    def get(self, topic, default=None):
+        value = self.values.get(topic)
+        if value is None:
+            return default
+        return value
+
+    def get_float(self, topic, default=0.0):
+        try:
+            return float(self.get(topic, default))
+        except ValueError:
+            return default
+
+
+sensors = SensorInputs()
+
+
+class Telemetry:
+    """Low overhead performance statistics, published periodically as JSON.
+
+    record() appends a timing to a fixed size ring buffer for that metric and
+    count() bumps a counter; both return straight away while telemetry is
+    disabled. Gauges are functions that are only called when a snapshot is
+    taken.
+    """
+    def __init__(self, size=256):
+        self.enabled = False
+        self.size = size
+        self.samples = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        try:
+            self.samples[name].append(value)
+        except KeyError:
+            self.samples[name] = collections.deque([value], maxlen=self.size)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self, interval):
+        """Summarise and reset the samples and counters gathered over interval seconds."""
+        stats = {}
+        for name in list(self.samples):
+            samples = np.array(list(self.samples[name]))
+            self.samples[name].clear()
+            if len(samples):
+                stats[name] = {'mean': round(float(samples.mean()), 3),
+                               'max': round(float(samples.max()), 3),
+                               'count': len(samples)}
+        for name in list(self.counters):
+            stats[name + '_per_sec'] = round(self.counters.pop(name) / interval, 1)
+        for name, function in list(self.gauges.items()):
+            try:
+                stats[name] = function()
+            except Exception:
+                logger.exception("Exception reading gauge {}".format(name))
+        return stats
+
+
+telemetry = Telemetry()
+
+
+class CpuUsage:
+    """Gauge of the process's CPU use, as a percentage of one core, since it was last read."""
+    def __init__(self):
+        self.last = time.monotonic(), time.process_time()
+
+    def __call__(self):
+        now = time.monotonic(), time.process_time()
+        elapsed, used = now[0] - self.last[0], now[1] - self.last[1]
+        self.last = now
+        return round(100 * used / elapsed, 1) if elapsed > 0 else 0.0
+
+
+telemetry.gauge('cpu_percent', CpuUsage())
+
+
+class StatsPublisher(threading.Thread):
+    """Publishes a telemetry snapshot to topic every interval seconds."""
+    topic = "display/g1/leds/stats"
+
+    def __init__(self, client, interval):
+        super().__init__()
+        self.client = client
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.publish()
+
+    def publish(self):
+        started = time.perf_counter()
+        payload = json.dumps(telemetry.snapshot(self.interval))
+        self.client.publish(self.topic, payload)
+        telemetry.record('telemetry.publish_ms', (time.perf_counter() - started) * 1000)
+
+
+CompiledZone = collections.namedtuple('CompiledZone', 'mask indices outside start stop')
+
+
+class Zone:
+    """A named set of [start, stop) pixel ranges.
+
+    A stop of None runs to the end of the frame. The ranges are compiled
+    once per frame size into a boolean mask and index arrays, so a zone can
+    be drawn, or a program kept inside it, with a single masked assignment.
+    """
+    def __init__(self, name, ranges):
+        self.name = name
+        self.ranges = [(start, stop) for start, stop in ranges]
+        self.compiled = {}
+
+    def compile(self, pixels):
+        try:
+            return self.compiled[pixels]
+        except KeyError:
+            pass
+        mask = np.zeros(pixels, dtype=bool)
+        for start, stop in self.ranges:
+            mask[start:stop] = True
+        indices = np.flatnonzero(mask)
+        if len(indices):
+            start, stop = int(indices[0]), int(indices[-1]) + 1
+        else:
+            start, stop = 0, 0
+        compiled = CompiledZone(mask, indices, np.flatnonzero(~mask), start, stop)
+        self.compiled[pixels] = compiled
+        return compiled
+
+
+zones = {
+    "projector": Zone("projector", [(0, 387), (505, None)]),
+    "projector gap": Zone("projector gap", [(387, 505)]),
+}
+
+
+def get_zone(zone):
+    if isinstance(zone, Zone):
+        return zone
+    return zones[zone]
+
+
+def load_zones(path):
+    """Add or replace zones from a JSON file of {"name": [[start, stop], ...]}."""
+    with open(path) as f:
+        for name, ranges in json.load(f).items():
+            zones[name] = Zone(name, ranges)
+            logger.info("loaded zone {}: {}".format(name, ranges))
 
 
 class LedExit(Exception):
@@ -61,28 +472,142 @@ class LedExit(Exception):
 
 
 class Frame:
-    def __init__(self, pixels, timeout=None):
-        self.last_write = 0
+    """A layer of pixels drawn by one program, composited by the Renderer.
+
+    Higher priority frames are drawn over lower ones using their blend mode
+    and opacity. A frame with a timeout stops being drawn that many seconds
+    after it was last shown, fading out over fade seconds if fade is set.
+    """
+    def __init__(self, pixels, timeout=None, priority=0, opacity=1.0, blend='over', fade=0):
+        if blend not in blend_modes:
+            raise ValueError("unknown blend mode {}".format(blend))
+        # monotonic time starts near zero at boot, so never shown is -inf
+        self.last_write = float('-inf')
         self.pixels = pixels
-        self.data = [0] * pixels
-        self.data2 = self.data.copy()
+        # data is written by the program, data2 is the last shown frame;
+        # show() swaps them rather than copying into a fresh list
+        self.data = np.zeros(pixels, dtype=np.uint32)
+        self.data2 = np.zeros(pixels, dtype=np.uint32)
         self.timeout = timeout
+        self.priority = priority
+        self.opacity = opacity
+        self.blend = blend
+        self.fade = fade
         self.frame_ready = threading.Event()
+        # pixels written since the last show, and changed since the renderer
+        # last looked, as [start, stop) spans
+        self.dirty_start, self.dirty_stop = pixels, 0
+        self.changed_start, self.changed_stop = pixels, 0
+        # perf_counter() of the oldest change the renderer hasn't taken
+        self.changed_at = None
+        # bumped by every show that changed something
+        self.generation = 0
+        self.frames_skipped = 0
+
+    def resize(self, pixels):
+        """Change the number of pixels, clearing the frame. For use before
+        any program has been given the frame, as programs size themselves
+        from it."""
+        with render_condition:
+            self.pixels = pixels
+            self.data = np.zeros(pixels, dtype=np.uint32)
+            self.data2 = np.zeros(pixels, dtype=np.uint32)
+            self.dirty_start, self.dirty_stop = pixels, 0
+            self.changed_start, self.changed_stop = pixels, 0
+            self.changed_at = None
+
+    def mark_dirty(self, start, stop):
+        if start < self.dirty_start:
+            self.dirty_start = start
+        if stop > self.dirty_stop:
+            self.dirty_stop = stop
 
     def set_pixel(self, pixel, colour):
         try:
             self.data[pixel] = colour
         except IndexError:
-            pass
+            return
+        if pixel < 0:
+            pixel += self.pixels
+        self.mark_dirty(pixel, pixel + 1)
 
     def set_all(self, colour):
-        for pixel in range(0, self.pixels):
-            self.data[pixel] = colour
+        self.data.fill(colour)
+        self.mark_dirty(0, self.pixels)
+
+    def set_range(self, start, stop, colour):
+        """Set pixels start to stop (exclusive) to a colour or array of colours."""
+        start = max(start, 0)
+        stop = min(stop, self.pixels)
+        if start < stop:
+            self.data[start:stop] = colour
+            self.mark_dirty(start, stop)
+
+    def set_array(self, colours, offset=0):
+        """Copy an array of colours into the frame starting at offset.
+
+        Colours that would fall off the end of the frame are dropped.
+        """
+        colours = colours[:max(self.pixels - offset, 0)]
+        if len(colours):
+            self.data[offset:offset + len(colours)] = colours
+            self.mark_dirty(offset, offset + len(colours))
+
+    def set_where(self, mask, colours):
+        """Copy colours, an array the size of the frame, wherever mask is True."""
+        touched = np.flatnonzero(mask)
+        if len(touched):
+            np.copyto(self.data, colours, where=mask)
+            self.mark_dirty(int(touched[0]), int(touched[-1]) + 1)
+
+    def set_zone(self, zone, colour):
+        """Set the pixels in a zone to a colour, or to the matching pixels of an
+        array of colours the size of the frame.
+
+        zone may be a Zone or the name of one in zones.
+        """
+        compiled = get_zone(zone).compile(self.pixels)
+        if np.ndim(colour) == 0:
+            self.data[compiled.indices] = colour
+        else:
+            np.copyto(self.data, colour, where=compiled.mask)
+        self.mark_dirty(compiled.start, compiled.stop)
+
+    def clear_outside(self, zone):
+        """Set every pixel outside a zone to black."""
+        outside = get_zone(zone).compile(self.pixels).outside
+        if len(outside):
+            self.data[outside] = 0
+            self.mark_dirty(int(outside[0]), int(outside[-1]) + 1)
 
     def show(self):
-        self.last_write = time.time()
-        self.data2 = self.data.copy()
-        self.frame_ready.set()
+        with render_condition:
+            self.last_write = time.monotonic()
+            start, stop = self.dirty_start, self.dirty_stop
+            self.dirty_start, self.dirty_stop = self.pixels, 0
+            if start < stop and not np.array_equal(self.data[start:stop], self.data2[start:stop]):
+                self.data, self.data2 = self.data2, self.data
+                # programs draw incrementally, so carry the changes forward
+                np.copyto(self.data[start:stop], self.data2[start:stop])
+                self.changed_start = min(self.changed_start, start)
+                self.changed_stop = max(self.changed_stop, stop)
+                if self.changed_at is None:
+                    self.changed_at = time.perf_counter()
+                self.generation += 1
+                self.frame_ready.set()
+            else:
+                self.frames_skipped += 1
+            # notify regardless, a repeated frame still keeps the frame alive
+            notify_render()
+
+    def take_changes(self):
+        """Return the [start, stop) span changed since the last call, and when
+        the first of those changes was shown, and reset them."""
+        changes = self.changed_start, self.changed_stop, self.changed_at
+        self.changed_start, self.changed_stop = self.pixels, 0
+        self.changed_at = None
+        self.frame_ready.clear()
+        return changes
 
     def get_pixels(self):
         return self.data
@@ -93,26 +618,76 @@ class Frame:
     def active(self):
         if self.timeout is None:
             return True
-        elif time.time() - self.last_write < self.timeout:
+        elif time.monotonic() - self.last_write < self.timeout:
             return True
         else:
             return False
 
-    def render_strip(self, strip):
-        if self.frame_ready.is_set():
-            self.frame_ready.clear()
-            for i in range(0, self.pixels):
-                strip.setPixelColor(i, self.data2[i])
-            strip.show()
+    def alpha(self, now):
+        """Opacity at monotonic time now, allowing for the timeout fade."""
+        if self.timeout is None:
+            return self.opacity
+        age = now - self.last_write
+        if age < self.timeout:
+            return self.opacity
+        elif age < self.timeout + self.fade:
+            return self.opacity * (1 - (age - self.timeout) / self.fade)
+        else:
+            return 0.0
+
+    def next_change(self, now):
+        """Seconds until alpha() next changes, or None if it won't by itself."""
+        if self.timeout is None:
+            return None
+        age = now - self.last_write
+        if age < self.timeout:
+            return self.timeout - age
+        elif age < self.timeout + self.fade:
+            return Compositor.fade_interval
+        else:
+            return None
 
 
 class LedProgram:
-    def __init__(self, frame, *args, **kwargs):
+    """Base class for animations drawn into a Frame.
+
+    setup() takes the program's arguments and loop() is a generator that
+    draws and shows frames, yielding the number of seconds until the next
+    frame is due. steps() runs the two together; the animation worker steps
+    it between other jobs, while run() paces it on a thread of its own.
+
+    Passing zone= restricts the program to that zone: everything outside it
+    is blacked out as each frame is shown. values= gives starting values of
+    its parameters, set after each setup().
+
+    parameters maps the attributes that can be changed while the program
+    runs to the type they are parsed as; each can be set over MQTT at
+    display/g1/leds/<preset>/<parameter>. Programs whose output repeats can
+    return the number of frames in one period from cache_frames(), so that
+    AnimationCache can record and replay them.
+    """
+    parameters = {}
+    # extra names the parameters can be set by, as {alias: parameter}
+    parameter_aliases = {}
+    # whether --isolate may run the program in a process of its own; programs
+    # fed from this process, by MQTT sensors or posted actions, can't be
+    isolatable = True
+
+    def __init__(self, frame, *args, zone=None, values=None, **kwargs):
         self.frame = frame
+        self.zone = zone
+        self.values = dict(values or {})
         self.args = args
         self.kwargs = kwargs
         self.pixel_count = frame.get_size()
-        self.exit_requested = False
+        self.exit_event = threading.Event()
+        self.clock = FrameClock()
+        self.prepared = False
+        self.switch_requested = None
+
+    @property
+    def exit_requested(self):
+        return self.exit_event.is_set()
 
     def set_pixel(self, pixel, colour):
         self.frame.set_pixel(pixel, colour)
@@ -120,16 +695,46 @@ class LedProgram:
     def set_all(self, colour):
         self.frame.set_all(colour)
 
+    def set_range(self, start, stop, colour):
+        self.frame.set_range(start, stop, colour)
+
+    def set_array(self, colours, offset=0):
+        self.frame.set_array(colours, offset)
+
+    def set_zone(self, zone, colour):
+        self.frame.set_zone(zone, colour)
+
     def show(self):
         if self.exit_requested:
             raise LedExit()
+        if self.zone is not None:
+            self.frame.clear_outside(self.zone)
         self.frame.show()
+        if self.switch_requested is not None:
+            logger.info("{} showing first frame {:.1f}ms after it was requested".format(
+                type(self).__name__, (time.monotonic() - self.switch_requested) * 1000))
+            self.switch_requested = None
+
+    def prepare(self):
+        """Run setup() ahead of steps(), while the previous program is still showing."""
+        self.exit_event.clear()
+        self.clock.reset()
+        self.setup(*self.args, **self.kwargs)
+        for name, value in self.values.items():
+            setattr(self, name, value)
+        self.prepared = True
+
+    def steps(self):
+        """Generate the program's frames, yielding the interval until the next one."""
+        if not self.prepared:
+            self.prepare()
+        self.prepared = False
+        while True:
+            yield from self.loop()
 
     def run(self):
-        self.exit_requested = False
-        self.setup(*self.args, **self.kwargs)
-        while not self.exit_requested:
-            self.loop()
+        for interval in self.steps():
+            self.wait_next_frame(interval)
 
     def setup(self):
         pass
@@ -138,15 +743,31 @@ class LedProgram:
         raise LedExit()
 
     def stop(self):
-        self.exit_requested = True
+        self.exit_event.set()
 
     def sleep(self, t):
-        if self.exit_requested:
+        """Sleep for t seconds, raising LedExit as soon as stop() is called."""
+        if self.exit_event.wait(t):
             raise LedExit()
-        time.sleep(t)
+
+    def wait_next_frame(self, interval):
+        """Sleep until the next frame is due, interval seconds after the last was."""
+        self.sleep(max(0, self.clock.next_deadline(interval) - time.monotonic()))
+
+    def stats(self):
+        return self.clock.stats()
+
+    def cache_frames(self):
+        return None
+
+    def parameter_values(self):
+        return {name: getattr(self, name) for name in self.parameters}
 
 
 class Zap(LedProgram):
+    def cache_frames(self):
+        return self.pixel_count
+
     def setup(self):
         self.black = rgb_to_24bit(0, 0, 0)
         self.white = rgb_to_24bit(255, 255, 255)
@@ -157,45 +778,47 @@ class Zap(LedProgram):
             self.set_pixel(p, self.white)
             self.set_pixel((p-1) % self.pixel_count, self.black)
             self.show()
-            self.sleep(0.001)
+            yield 0.001
 
 
 class Rainbow(LedProgram):
+    parameters = {'multiplier': float, 'speed': float}
+
+    def cache_frames(self):
+        return 360
+
     def setup(self, multiplier=2, interval=0.040):
         self.multiplier = multiplier
         self.interval = interval
         self.speed = 1
         self.scaling = 360.0/self.pixel_count * self.multiplier
+        self.rainbow = RainbowEngine.shared(self.pixel_count)
 
     def loop(self):
         for hue in range(0, 360):
-            scaling = 360.0/self.pixel_count * self.multiplier
-            for pixel in range(0, self.pixel_count):
-                if pixel >= 0:
-                    hue2 = ((hue*self.speed)+(pixel*scaling)) % 360
-                    (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
-                    self.set_pixel(pixel, rgb_to_24bit(int(r*255), int(g*255), int(b*255)))
+            self.set_array(self.rainbow.row(hue, self.speed, self.multiplier))
             self.show()
-            self.sleep(self.interval)
+            yield self.interval
 
 
 class DimRainbow(LedProgram):
+    parameters = {'multiplier': float, 'speed': float}
+
+    def cache_frames(self):
+        return 360
+
     def setup(self, multiplier=2, interval=0.040):
         self.multiplier = multiplier
         self.interval = interval
         self.speed = 1
         self.scaling = 360.0/self.pixel_count * self.multiplier
+        self.rainbow = RainbowEngine.shared(self.pixel_count)
 
     def loop(self):
         for hue in range(0, 360):
-            scaling = 360.0/self.pixel_count * self.multiplier
-            for pixel in range(0, self.pixel_count):
-                if pixel >= 0:
-                    hue2 = ((hue*self.speed)+(pixel*scaling)) % 360
-                    (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
-                    self.set_pixel(pixel, rgb_to_24bit(int(r*255/5), int(g*255/5), int(b*255/5)))
+            self.set_array(self.rainbow.row(hue, self.speed, self.multiplier, divisor=5))
             self.show()
-            self.sleep(self.interval)
+            yield self.interval
 
 
 class ProjectorBow(Rainbow):
@@ -204,58 +827,64 @@ class ProjectorBow(Rainbow):
         self.interval = interval
         self.speed = 1
         self.scaling = 360.0/self.pixel_count * self.multiplier
+        self.rainbow = RainbowEngine.shared(self.pixel_count)
 
     def loop(self):
         for hue in range(0, 360):
-            scaling = 360.0/self.pixel_count * self.multiplier
-            for pixel in range(0, self.pixel_count):
-                if pixel >= 0 and (pixel <= 386 or pixel >= 505):
-                    hue2 = ((hue*self.speed)+(pixel*scaling)) % 360
-                    (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
-                    self.set_pixel(pixel, rgb_to_24bit(int(r*255), int(g*255), int(b*255)))
-                elif pixel > 386 and pixel < 505:
-                    self.set_pixel(pixel, rgb_to_24bit(0, 0, 0))
+            self.set_array(self.rainbow.row(hue, self.speed, self.multiplier))
+            self.set_zone("projector gap", rgb_to_24bit(0, 0, 0))
             self.show()
-            self.sleep(self.interval)
+            yield self.interval
 
 
 class Chase(LedProgram):
+    parameters = {'n': int, 'speed': float}
+    parameter_aliases = {'pixels': 'n'}
+
+    def cache_frames(self):
+        return self.n
+
     def setup(self, n=5, t=0.05):
         self.n = n
         self.t = t
         self.speed = 1
 
     def loop(self):
-        while True:
-            for i in range(0, self.n):
-                for p in range(0, self.pixel_count):
-                    if p % self.n == i:
-                        self.set_pixel(p, rgb_to_24bit(255, 255, 255))
-                    elif (p+1) % self.n == i:
-                        self.set_pixel(p, rgb_to_24bit(15, 15, 15))
-                    else:
-                        self.set_pixel(p, rgb_to_24bit(0, 0, 0))
-                self.show()
-                time.sleep(self.t / self.speed)
+        for i in range(0, self.n):
+            for p in range(0, self.pixel_count):
+                if p % self.n == i:
+                    self.set_pixel(p, rgb_to_24bit(255, 255, 255))
+                elif (p+1) % self.n == i:
+                    self.set_pixel(p, rgb_to_24bit(15, 15, 15))
+                else:
+                    self.set_pixel(p, rgb_to_24bit(0, 0, 0))
+            self.show()
+            yield self.t / self.speed
 
 
 class Emergency(LedProgram):
+    def cache_frames(self):
+        return 2
+
     def setup(self):
         self.red = rgb_to_24bit(255, 0, 0)
         self.blue = rgb_to_24bit(0, 0, 255)
         self.white = rgb_to_24bit(255, 255, 255)
 
     def loop(self):
-        while True:
-            self.set_all(self.blue)
-            self.show()
-            self.sleep(0.25)
-            self.set_all(self.red)
-            self.show()
-            self.sleep(0.25)
+        self.set_all(self.blue)
+        self.show()
+        yield 0.25
+        self.set_all(self.red)
+        self.show()
+        yield 0.25
 
 
 class Emergency2(LedProgram):
+    def cache_frames(self):
+        # fades 1 up to 100 and back down to 2 before repeating
+        return 198
+
     def setup(self):
         self.red = rgb_to_24bit(255, 0, 0)
         self.fade = rgb_to_24bit(0, 0, 0)
@@ -264,75 +893,89 @@ class Emergency2(LedProgram):
         self.current = 0
 
     def loop(self):
-        while True:
-            if self.current >= 100:
-                self.reverse = True
-            if self.current <= 1:
-                self.reverse = False
+        if self.current >= 100:
+            self.reverse = True
+        if self.current <= 1:
+            self.reverse = False
 
-            if self.reverse:
-                self.current -= 1
-            else:
-                self.current += 1
+        if self.reverse:
+            self.current -= 1
+        else:
+            self.current += 1
 
-            self.fade = rgb_to_24bit(self.current, 0, 0)
-            self.set_all(self.fade)
-            self.show()
-            self.sleep(0.001)
+        self.fade = rgb_to_24bit(self.current, 0, 0)
+        self.set_all(self.fade)
+        self.show()
+        yield 0.001
 
 
 class Bercostat(LedProgram):
-    def setup(self):
+    rheostat_topic = "sensor/rheostat"
+    isolatable = False
+
+    def setup(self, interval=0.040):
+        self.interval = interval
         self.black = rgb_to_24bit(0, 0, 0)
         self.set_all(self.black)
+        sensors.subscribe(self.rheostat_topic)
 
     def loop(self):
-        rheostat = mqtt.subscribe.simple("sensor/rheostat", hostname="mqtt")
-        chosen_pixel = float(rheostat.payload.decode('utf-8')) * 7.76
+        chosen_pixel = sensors.get_float(self.rheostat_topic) * 7.76
         chosen_pixel = math.floor(chosen_pixel)
-        for p in range(0, self.pixel_count):
-            if p <= chosen_pixel:
-                self.set_pixel(p, rgb_to_24bit(255, 255, 255))
-                self.show()
-            else:
-                self.set_pixel(p, rgb_to_24bit(0, 0, 0))
-                self.show()
+        lit = min(max(chosen_pixel + 1, 0), self.pixel_count)
+        self.set_range(0, lit, rgb_to_24bit(255, 255, 255))
+        self.set_range(lit, self.pixel_count, self.black)
+        self.show()
+        yield self.interval
 
 
 class BercostatBow(Rainbow):
+    isolatable = False
+
+    def cache_frames(self):
+        # follows the rheostat, so never repeats
+        return None
+
     def setup(self, multiplier=2, interval=0.040):
         self.multiplier = multiplier
         self.interval = interval
         self.speed = 1
         self.scaling = 360.0/self.pixel_count * self.multiplier
+        self.rainbow = RainbowEngine.shared(self.pixel_count)
         self.black = rgb_to_24bit(0, 0, 0)
         self.set_all(self.black)
+        sensors.subscribe(Bercostat.rheostat_topic)
 
     def loop(self):
         for hue in range(0, 360):
-            scaling = 360.0/self.pixel_count * self.multiplier
-
-            rheostat = mqtt.subscribe.simple("sensor/rheostat", hostname="mqtt")
-            chosen_pixel = float(rheostat.payload.decode('utf-8')) * 7.76
+            chosen_pixel = sensors.get_float(Bercostat.rheostat_topic) * 7.76
             chosen_pixel = math.floor(chosen_pixel)
 
-            for pixel in range(0, self.pixel_count):
-                if pixel <= chosen_pixel:
-                    hue2 = ((hue*self.speed)+(pixel*scaling)) % 360
-                    (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
-                    self.set_pixel(pixel, rgb_to_24bit(int(r*255), int(g*255), int(b*255)))
-                else:
-                    self.set_pixel(pixel, rgb_to_24bit(0, 0, 0))
+            lit = min(max(chosen_pixel + 1, 0), self.pixel_count)
+            self.set_array(self.rainbow.row(hue, self.speed, self.multiplier)[:lit])
+            self.set_range(lit, self.pixel_count, rgb_to_24bit(0, 0, 0))
             self.show()
-            self.sleep(self.interval)
+            yield self.interval
 
 
 class PixelPicker(LedProgram):
-    def setup(self, data=None):
+    """Sets individual pixels from updates posted over MQTT.
+
+    Every frame all pending updates are merged, the last write to a pixel
+    winning, and applied to the frame in one write before it is shown. See
+    parse() for the accepted update formats.
+    """
+    isolatable = False
+    span_pattern = re.compile(r'^(-?\d+)-(-?\d+)$')
+
+    def setup(self, data=None, interval=0.040):
         if data is None:
             data = {}
 
         self.data = data
+        self.interval = interval
+        self.pending = np.zeros(self.pixel_count, dtype=np.uint32)
+        self.touched = np.zeros(self.pixel_count, dtype=bool)
         self.black = rgb_to_24bit(0, 0, 0)
         self.set_all(self.black)
         self.show()
@@ -346,23 +989,66 @@ class PixelPicker(LedProgram):
             return self._action_queue
 
     def post(self, data):
-        self.action_queue.put(data)
+        self.action_queue.put(self.parse(data))
+
+    @classmethod
+    def parse(cls, data):
+        """Turn an update into arrays of pixel numbers and colours.
+
+        An update is one of:
+         * a dict of pixel number to [r, g, b], where a key of "first-last"
+           sets that inclusive range to one [r, g, b] or a list of them;
+           pixels outside the frame, negative ones included, are ignored,
+         * a list of [r, g, b] starting at pixel 0,
+         * bytes of a big-endian 16 bit start pixel and packed r, g, b bytes.
+        """
+        if isinstance(data, (bytes, bytearray)):
+            if len(data) < 2:
+                raise ValueError("binary picker update is too short")
+            start = (data[0] << 8) + data[1]
+            colours = decode_rgb(data[2:])
+            return np.arange(start, start + len(colours)), colours
+        if isinstance(data, list):
+            rgb = np.array(data, dtype=np.int64).reshape(-1, 3)
+            return np.arange(len(rgb)), rgb_array_to_24bit(rgb[:, 0], rgb[:, 1], rgb[:, 2])
+        pixels, colours = [], []
+        for key, value in data.items():
+            match = cls.span_pattern.match(str(key))
+            if match:
+                span = np.arange(int(match.group(1)), int(match.group(2)) + 1)
+            else:
+                span = np.arange(int(key), int(key) + 1)
+            rgb = np.array(value, dtype=np.int64).reshape(-1, 3)
+            colour = rgb_array_to_24bit(rgb[:, 0], rgb[:, 1], rgb[:, 2])
+            pixels.append(span)
+            colours.append(np.broadcast_to(colour, span.shape))
+        if not pixels:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+        return np.concatenate(pixels), np.concatenate(colours)
 
     def loop(self):
-        try:
-            data = self.action_queue.get(timeout=0.1)
-        except queue.Empty:
-            pass
-        else:
-            for key in data:
-                self.set_pixel(
-                    int(key),
-                    rgb_to_24bit(data[key][0], data[key][1], data[key][2])
-                )
+        updated = False
+        while True:
+            try:
+                pixels, colours = self.action_queue.get_nowait()
+            except queue.Empty:
+                break
+            keep = (pixels >= 0) & (pixels < self.pixel_count)
+            self.pending[pixels[keep]] = colours[keep]
+            self.touched[pixels[keep]] = True
+            updated = True
+        if updated:
+            self.frame.set_where(self.touched, self.pending)
+            self.touched.fill(False)
+        # shown every frame, even unchanged, so the frame doesn't time out
         self.show()
+        yield self.interval
 
 
 class TestChecker(LedProgram):
+    def cache_frames(self):
+        return 2
+
     def setup(self):
         self.black = rgb_to_24bit(0, 0, 0)
         self.white = rgb_to_24bit(255, 255, 255)
@@ -374,14 +1060,14 @@ class TestChecker(LedProgram):
             else:
                 self.set_pixel(p, self.white)
         self.show()
-        self.sleep(1)
+        yield 1
         for p in range(0, self.pixel_count):
             if p % 2 == 0:
                 self.set_pixel(p, self.white)
             else:
                 self.set_pixel(p, self.black)
         self.show()
-        self.sleep(1)
+        yield 1
 
 
 class StaticColour(LedProgram):
@@ -391,11 +1077,404 @@ class StaticColour(LedProgram):
     def loop(self):
         self.set_all(self.colour)
         self.show()
-        self.sleep(0.5)
+        yield 0.5
+
+
+class AudioAnalyser(threading.Thread):
+    """Turns a stream of PCM audio into frequency band levels on a thread of its own.
+
+    source is a file or named pipe of signed 16 bit little-endian mono
+    samples, or udp:PORT to take them as datagrams; a regular file is played
+    at sample_rate and looped, for testing. Every hop samples the latest
+    window is Hann windowed and transformed, its power summed into bands
+    spaced logarithmically from 40Hz, and scaled to levels between 0 and 1
+    over the dynamic_range dB below a slowly decaying peak.
+
+    Each result replaces spectrum, a tuple of the perf_counter() time its
+    newest samples arrived and the levels, in a single assignment, so
+    readers never wait for the analysis and the analysis never waits for
+    them.
+    """
+    window_size = 1024
+    hop = 256
+    dynamic_range = 50.0
+    # dBFS the peak never decays below, so silence stays dark
+    quietest = -40.0
+    decay = 0.05
+    running = {}
+
+    def __init__(self, source, sample_rate=44100, bands=16):
+        super().__init__()
+        self.source = source
+        self.sample_rate = sample_rate
+        self.bands = bands
+        self.spectrum = None
+        self.samples = np.zeros(self.window_size, dtype=np.float32)
+        self.taper = np.hanning(self.window_size).astype(np.float32)
+        # dB relative to a full scale sine
+        self.reference = (self.taper.sum() / 2) ** 2
+        bin_width = sample_rate / self.window_size
+        edges = np.geomspace(40, sample_rate / 2, bands + 1) / bin_width
+        # every band gets at least one bin of its own
+        steps = np.arange(bands + 1)
+        edges = np.maximum(np.round(edges).astype(np.int64), 1)
+        edges = np.maximum.accumulate(edges - steps) + steps
+        self.edges = np.minimum(edges, self.window_size // 2 + 1)
+        self.peak = self.quietest
+        self.fresh = 0
+
+    @classmethod
+    def shared(cls, source):
+        """The running analyser for source, started on first use."""
+        try:
+            return cls.running[source]
+        except KeyError:
+            analyser = cls.running[source] = cls(source)
+            analyser.daemon = True
+            analyser.start()
+            return analyser
+
+    def run(self):
+        while True:
+            try:
+                if self.source.startswith('udp:'):
+                    self.receive(int(self.source[4:]))
+                else:
+                    self.read(self.source)
+            except Exception:
+                logger.exception("Exception reading audio from {}".format(self.source))
+                time.sleep(1)
+
+    def receive(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("0.0.0.0", port))
+            buffer = bytearray(65536)
+            while True:
+                length = sock.recv_into(buffer)
+                samples = np.frombuffer(buffer, dtype='<i2', count=length // 2)
+                self.feed(samples, time.perf_counter())
+        finally:
+            sock.close()
+
+    def read(self, path):
+        paced = os.path.isfile(path)
+        clock = FrameClock()
+        buffer = bytearray(self.hop * 2)
+        with open(path, 'rb', buffering=0) as source:
+            while True:
+                length = source.readinto(buffer)
+                if not length:
+                    if not paced:
+                        # the writer closed the pipe, wait for the next one
+                        return
+                    source.seek(0)
+                    continue
+                samples = np.frombuffer(buffer, dtype='<i2', count=length // 2)
+                self.feed(samples, time.perf_counter())
+                if paced:
+                    deadline = clock.next_deadline(len(samples) / self.sample_rate)
+                    time.sleep(max(0, deadline - time.monotonic()))
+
+    def feed(self, samples, arrived):
+        count = min(len(samples), self.window_size)
+        if count == 0:
+            return
+        self.samples[:-count] = self.samples[count:]
+        self.samples[-count:] = samples[-count:]
+        self.samples[-count:] /= 32768
+        self.fresh += len(samples)
+        if self.fresh >= self.hop:
+            self.fresh = 0
+            self.analyse(arrived)
+
+    def analyse(self, arrived):
+        started = time.perf_counter()
+        power = np.abs(np.fft.rfft(self.samples * self.taper)) ** 2
+        bands = np.add.reduceat(power[:self.edges[-1]], self.edges[:-1])
+        db = 10 * np.log10(bands / self.reference + 1e-12)
+        self.peak = max(self.peak - self.decay, float(db.max()), self.quietest)
+        levels = np.clip((db - self.peak) / self.dynamic_range + 1, 0, 1)
+        self.spectrum = (arrived, levels)
+        telemetry.record('audio.analyse_ms', (time.perf_counter() - started) * 1000)
+
+
+class AudioReactive(LedProgram):
+    """Lights the strip from live audio, see AudioAnalyser for the sources.
+
+    The strip is split into one segment per frequency band, bass first,
+    coloured along a rainbow, with each segment's brightness following its
+    band's level. A frame is drawn whenever a new analysis is published;
+    while everything is silent nothing is shown, so the frame times out.
+    """
+    parameters = {'gain': float}
+    # the analyser reads its source in this process
+    isolatable = False
+
+    def setup(self, source, interval=0.005):
+        self.analyser = AudioAnalyser.shared(source)
+        self.interval = interval
+        self.gain = 1.0
+        self.band = np.arange(self.pixel_count) * self.analyser.bands // self.pixel_count
+        hues = self.band * 300.0 / self.analyser.bands
+        self.base = RainbowEngine.colours(hues).view(np.uint8).reshape(-1, 4).astype(np.float32)
+        self.colours = np.zeros(self.pixel_count, dtype=np.uint32)
+        self.spectrum = None
+
+    def loop(self):
+        while True:
+            spectrum = self.analyser.spectrum
+            if spectrum is not self.spectrum:
+                self.spectrum = spectrum
+                arrived, levels = spectrum
+                if levels.any():
+                    levels = np.minimum(levels * self.gain, 1)[self.band]
+                    np.multiply(self.base, levels[:, np.newaxis], casting='unsafe',
+                                out=self.colours.view(np.uint8).reshape(-1, 4))
+                    self.set_array(self.colours)
+                    self.show()
+                    telemetry.record('audio.latency_ms', (time.perf_counter() - arrived) * 1000)
+            yield self.interval
+
+
+class AnimationCache:
+    """Records one period of a repeating program to disk and replays it.
+
+    Recordings are keyed by the program's class, arguments, zone, size and
+    parameter values, so changing a parameter over MQTT switches to a
+    different recording at the next frame. A recording that doesn't exist
+    yet is made on a thread of its own while the program keeps running live,
+    and playback moves over to it once it is ready. Each file is a header,
+    the interval after each frame, then the packed frames, and is played back
+    from an mmap. Files beyond max_bytes on disk and mappings beyond max_open
+    are dropped least recently used first.
+    """
+    header = struct.Struct('<4sII4x')
+    magic = b'LEDC'
+    # recordings are invalidated whenever this file changes
+    version = os.path.getmtime(__file__)
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, max_open=8):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.mapped = collections.OrderedDict()
+        # keys being recorded, and those whose recording failed
+        self.recording = set()
+        self.failed = set()
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def cacheable(self, program):
+        count = program.cache_frames()
+        return count is not None and count * program.pixel_count * 4 <= self.max_bytes // 4
+
+    def key(self, program):
+        description = repr((self.version, type(program).__name__, program.args,
+                            sorted(program.kwargs.items()), program.zone, program.pixel_count,
+                            sorted(program.parameter_values().items())))
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, program):
+        """Return (intervals, frames) arrays for program, or None if it isn't
+        recorded yet, starting the recording in the background."""
+        key = self.key(program)
+        try:
+            self.mapped.move_to_end(key)
+            return self.mapped[key]
+        except KeyError:
+            pass
+        filename = os.path.join(self.path, key + '.bin')
+        with self.lock:
+            if key in self.recording or key in self.failed:
+                return None
+            if not os.path.exists(filename):
+                self.recording.add(key)
+                thread = threading.Thread(target=self.record, daemon=True,
+                                          args=(program, program.parameter_values(), key))
+                thread.start()
+                return None
+        os.utime(filename)
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, pixel_count = self.header.unpack_from(data)
+        offset = self.header.size
+        intervals = np.frombuffer(data, dtype=np.float64, count=count, offset=offset)
+        offset += intervals.nbytes
+        frames = np.frombuffer(data, dtype=np.uint32, count=count * pixel_count, offset=offset)
+        self.mapped[key] = intervals, frames.reshape(count, pixel_count)
+        while len(self.mapped) > self.max_open:
+            # the mapping closes once playback lets go of its arrays
+            self.mapped.popitem(last=False)
+        return self.mapped[key]
+
+    def record(self, program, values, key):
+        try:
+            self.record_file(program, values, os.path.join(self.path, key + '.bin'))
+        except Exception:
+            logger.exception("recording {} failed, running it live".format(
+                type(program).__name__))
+            with self.lock:
+                self.failed.add(key)
+        finally:
+            with self.lock:
+                self.recording.discard(key)
+
+    def record_file(self, program, values, filename):
+        started = time.perf_counter()
+        frame = Frame(program.pixel_count)
+        clone = type(program)(frame, *program.args, zone=program.zone, **program.kwargs)
+        clone.prepare()
+        for name, value in values.items():
+            setattr(clone, name, value)
+        count = clone.cache_frames()
+        steps = clone.steps()
+        intervals = np.zeros(count, dtype=np.float64)
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(self.header.pack(self.magic, count, program.pixel_count))
+            f.seek(self.header.size + intervals.nbytes)
+            for i in range(count):
+                intervals[i] = next(steps)
+                f.write(frame.data2.tobytes())
+            f.seek(self.header.size)
+            f.write(intervals.tobytes())
+        steps.close()
+        os.replace(temporary, filename)
+        logger.info("recorded {} frames of {} in {:.0f}ms".format(
+            count, type(program).__name__, (time.perf_counter() - started) * 1000))
+        self.trim()
+
+    def trim(self):
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                 if name.endswith('.bin')]
+        files.sort(key=os.path.getmtime, reverse=True)
+        total = 0
+        for filename in files:
+            total += os.path.getsize(filename)
+            if total > self.max_bytes:
+                os.remove(filename)
+
+    def playback(self, program):
+        """Generate program's frames from its recording, like program.steps(),
+        running the program itself until the recording is ready."""
+        live = None
+        # frames since the program started, so a recording picks up in phase
+        position = 0
+        try:
+            while True:
+                key = self.key(program)
+                recording = self.get(program)
+                if recording is None:
+                    if live is None:
+                        live = program.steps()
+                    try:
+                        yield next(live)
+                    except StopIteration:
+                        return
+                    position += 1
+                    continue
+                intervals, frames = recording
+                while self.key(program) == key:
+                    i = position % len(frames)
+                    program.set_array(frames[i])
+                    program.show()
+                    yield float(intervals[i])
+                    position += 1
+        finally:
+            if live is not None:
+                live.close()
+
+
+class FrameAssembler:
+    """Reassembles frames sent as a sequence of 0x06 fragments.
+
+    Each fragment is a header of opcode, frame sequence number, fragment
+    index, fragment count (all big-endian 16 bit) and a 32 bit pixel offset,
+    followed by packed r, g, b bytes. Fragments are written into a staging
+    buffer, and the buffer is only handed back once every fragment of a frame
+    has arrived. A frame still incomplete when a newer one starts, or after
+    the deadline, is dropped; fragments of older frames are ignored as late,
+    and those whose index is out of range or whose count disagrees with the
+    frame's first fragment are ignored as invalid.
+    """
+    header = struct.Struct('>BHHHI')
+    reset_after = 1
+
+    def __init__(self, pixels, deadline=0.1):
+        self.staging = np.zeros(pixels, dtype=np.uint32)
+        self.deadline = deadline
+        self.sequence = None
+        self.latest = None
+        self.received = set()
+        self.count = 0
+        self.started = 0
+        self.updated = 0
+        self.last_late = None
+        self.frames_completed = 0
+        self.frames_dropped = 0
+        self.frames_late = 0
+        self.fragments_invalid = 0
+
+    @staticmethod
+    def newer(sequence, than):
+        return 0 < (sequence - than) % 0x10000 < 0x8000
+
+    def expire(self, now):
+        if self.sequence is not None and now - self.started > self.deadline:
+            logger.debug("dropping incomplete frame {} ({}/{} fragments)".format(
+                self.sequence, len(self.received), self.count))
+            self.frames_dropped += 1
+            self.sequence = None
+        if now - self.updated > self.reset_after:
+            # sender has gone quiet, accept whatever sequence it restarts from
+            self.latest = None
+
+    def add(self, data, now=None):
+        """Add one fragment packet, returning the staging buffer if it completes a frame."""
+        if len(data) < self.header.size:
+            return None
+        _, sequence, index, count, offset = self.header.unpack_from(data)
+        if index >= count:
+            self.fragments_invalid += 1
+            return None
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        self.updated = now
+
+        if self.latest is None or self.newer(sequence, self.latest):
+            if self.sequence is not None:
+                self.frames_dropped += 1
+            self.sequence = self.latest = sequence
+            self.count = count
+            self.received.clear()
+            self.started = now
+        elif sequence != self.sequence:
+            if sequence != self.last_late:
+                self.last_late = sequence
+                self.frames_late += 1
+            return None
+        elif count != self.count:
+            # disagrees with the frame's first fragment, so can't be trusted
+            self.fragments_invalid += 1
+            return None
+
+        colours = decode_rgb(data[self.header.size:])
+        colours = colours[:max(len(self.staging) - offset, 0)]
+        self.staging[offset:offset + len(colours)] = colours
+        self.received.add(index)
+        if len(self.received) < self.count:
+            return None
+        self.sequence = None
+        self.frames_completed += 1
+        return self.staging
 
 
 class ServerProgram(LedProgram):
     port = 2812
+    buffer_size = 65535
+    packets_received = 0
 
     def run(self):
         while True:
@@ -407,46 +1486,293 @@ class ServerProgram(LedProgram):
                 return
             time.sleep(1)
 
-    def loop(self):
+    def open_socket(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(("0.0.0.0", self.port))
-        while True:
-            data, address = sock.recvfrom(1500)
-            if len(data) > 0:
-                if data[0] == 0x01:
-                    # single colour
-                    r, g, b = data[1:4]
-                    self.set_all(r, g, b)
-                    self.show()
-                elif data[0] == 0x03:
-                    # full frame
-                    pos = 1
-                    pixel = 0
-                    while pos + 2 < len(data):
-                        r, g, b = data[pos:pos+3]
-                        self.set_pixel(pixel, rgb_to_24bit(r, g, b))
-                        pixel = pixel + 1
-                        pos = pos + 3
-                    self.show()
-                elif data[0] == 0x04:
-                    # partial frame + render
-                    pixel = (data[1] << 8) + data[2]
-                    pos = 3
-                    while pos + 2 < len(data):
-                        r, g, b = data[pos:pos+3]
-                        self.set_pixel(pixel, rgb_to_24bit(r, g, b))
-                        pixel = pixel + 1
-                        pos = pos + 3
+        try:
+            sock.bind(("0.0.0.0", self.port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def loop(self):
+        sock = self.open_socket()
+        try:
+            buffer = bytearray(self.buffer_size)
+            view = memoryview(buffer)
+            while not self.exit_requested:
+                sock.settimeout(1)
+                try:
+                    length = sock.recv_into(buffer)
+                except socket.timeout:
+                    self.assembler.expire(time.monotonic())
+                    continue
+                render = self.decode(view[:length])
+                # drain everything queued behind it so a burst renders once
+                sock.setblocking(False)
+                while True:
+                    try:
+                        length = sock.recv_into(buffer)
+                    except BlockingIOError:
+                        break
+                    render = self.decode(view[:length]) or render
+                if render:
                     self.show()
-                elif data[0] == 0x05:
-                    # partial frame + render
-                    pixel = (data[1] << 8) + data[2]
-                    pos = 3
-                    while pos + 2 < len(data):
-                        r, g, b = data[pos:pos+3]
-                        self.set_pixel(pixel, rgb_to_24bit(r, g, b))
-                        pixel = pixel + 1
-                        pos = pos + 3
+        finally:
+            sock.close()
+
+    def decode(self, data):
+        started = time.perf_counter()
+        self.packets_received += 1
+        render = self.handle_packet(data)
+        metric = 'udp.{}.'.format(self.port)
+        telemetry.count(metric + 'packets')
+        telemetry.record(metric + 'decode_ms', (time.perf_counter() - started) * 1000)
+        return render
+
+    def handle_packet(self, data):
+        """Decode one packet into the frame, returning True if it asks for a render."""
+        if len(data) == 0:
+            return False
+        if data[0] == 0x01 and len(data) >= 4:
+            # single colour
+            r, g, b = data[1:4]
+            self.set_all(rgb_to_24bit(r, g, b))
+            return True
+        elif data[0] == 0x03:
+            # full frame
+            self.set_array(decode_rgb(data[1:]))
+            return True
+        elif data[0] in (0x04, 0x05) and len(data) >= 3:
+            # partial frame, 0x04 renders and 0x05 waits for a later packet
+            pixel = (data[1] << 8) + data[2]
+            self.set_array(decode_rgb(data[3:]), pixel)
+            return data[0] == 0x04
+        elif data[0] == 0x06:
+            # fragment of a frame, rendered once every fragment has arrived
+            colours = self.assembler.add(data)
+            if colours is None:
+                return False
+            self.set_array(colours)
+            return True
+        return False
+
+    @property
+    def assembler(self):
+        try:
+            return self._assembler
+        except AttributeError:
+            self._assembler = FrameAssembler(self.pixel_count)
+            telemetry.gauge('udp.{}.fragments'.format(self.port), lambda: {
+                'completed': self._assembler.frames_completed,
+                'dropped': self._assembler.frames_dropped,
+                'late': self._assembler.frames_late,
+                'invalid': self._assembler.fragments_invalid,
+            })
+            return self._assembler
+
+
+class DmxProgram(ServerProgram):
+    """Base for receivers of standard lighting protocols carrying DMX universes.
+
+    Each universe's 512 channels hold 170 pixels as red, green, blue triples,
+    universe first_universe filling the frame from pixel 0 and the rest
+    following on. A universe whose sequence number is up to 20 behind the
+    last one from it is a late or duplicate packet and is dropped.
+    """
+    first_universe = 1
+    pixels_per_universe = 170
+    receive_buffer = 1 << 20
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sequences = {}
+        self.pending = False
+
+    def universes(self):
+        count = -(-self.pixel_count // self.pixels_per_universe)
+        return range(self.first_universe, self.first_universe + count)
+
+    def open_socket(self):
+        sock = super().open_socket()
+        # a frame arrives as a burst of one packet per universe
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        return sock
+
+    def in_sequence(self, universe, sequence):
+        last = self.sequences.get(universe)
+        if last is not None:
+            behind = (last - sequence) & 0xff
+            if behind < 20:
+                telemetry.count('dmx.{}.out_of_sequence'.format(self.port))
+                return False
+        self.sequences[universe] = sequence
+        return True
+
+    def set_universe(self, universe, channels):
+        """Write a universe's channels into the frame, returning False if it isn't mapped."""
+        offset = (universe - self.first_universe) * self.pixels_per_universe
+        if not 0 <= offset < self.pixel_count:
+            return False
+        self.set_array(decode_rgb(channels[:self.pixels_per_universe * 3]), offset)
+        return True
+
+
+class E131Program(DmxProgram):
+    """Receives E1.31 (streaming ACN) DMX data, as sent by xLights, QLC+ etc.
+
+    Joins the multicast group of each universe as well as taking unicast.
+    Universes sent with a synchronization address are held until a sync
+    packet for that address arrives, so a frame split over several
+    universes is shown all at once.
+    """
+    port = 5568
+    acn_id = b'ASC-E1.17\x00\x00\x00'
+    root = struct.Struct('>HH12sHI16s')
+    framing = struct.Struct('>HI64sBHBBH')
+    dmp = struct.Struct('>HBBHHHB')
+    sync_framing = struct.Struct('>HIBHH')
+    vector_data = 0x04
+    vector_extended = 0x08
+    vector_sync = 0x01
+    preview = 0x80
+    terminated = 0x40
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sync_address = None
+
+    def open_socket(self):
+        sock = super().open_socket()
+        failed = []
+        for universe in self.universes():
+            group = socket.inet_aton('239.255.{}.{}'.format(universe >> 8, universe & 0xff))
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                group + socket.inet_aton('0.0.0.0'))
+            except OSError as e:
+                failed.append(universe)
+                error = e
+        if failed:
+            if error.errno == errno.ENOBUFS:
+                # Linux allows net.ipv4.igmp_max_memberships groups per socket, 20 by default
+                error = "the limit on multicast memberships was reached"
+            logger.warning("E1.31 universes {} will only be received by unicast, "
+                           "joining their multicast groups failed: {}".format(
+                               ', '.join(str(universe) for universe in failed), error))
+        return sock
+
+    def handle_packet(self, data):
+        if len(data) < self.root.size + self.sync_framing.size:
+            return False
+        _, _, acn_id, _, vector, _ = self.root.unpack_from(data)
+        if acn_id != self.acn_id:
+            return False
+        if vector == self.vector_extended:
+            _, vector, _, sync_address, _ = self.sync_framing.unpack_from(data, self.root.size)
+            if vector != self.vector_sync or sync_address != self.sync_address:
+                return False
+            render, self.pending = self.pending, False
+            return render
+        if (vector != self.vector_data or
+                len(data) < self.root.size + self.framing.size + self.dmp.size):
+            return False
+        _, _, _, priority, sync_address, sequence, options, universe = \
+            self.framing.unpack_from(data, self.root.size)
+        if options & (self.preview | self.terminated) or not self.in_sequence(universe, sequence):
+            return False
+        _, _, _, _, _, count, start_code = self.dmp.unpack_from(
+            data, self.root.size + self.framing.size)
+        if start_code != 0:
+            return False
+        start = self.root.size + self.framing.size + self.dmp.size
+        if not self.set_universe(universe, data[start:start + count - 1]):
+            return False
+        if sync_address:
+            self.sync_address = sync_address
+            self.pending = True
+            return False
+        return True
+
+    @classmethod
+    def packet(cls, universe, sequence, channels, sync_address=0):
+        """Build an E1.31 data packet carrying channels."""
+        framing_length = cls.framing.size + cls.dmp.size + len(channels)
+        root_length = cls.root.size - 16 + framing_length
+        return b''.join((
+            cls.root.pack(0x10, 0, cls.acn_id, 0x7000 | root_length, cls.vector_data, b'\x00' * 16),
+            cls.framing.pack(0x7000 | framing_length, 0x02, b'leds'.ljust(64, b'\x00'),
+                             100, sync_address, sequence, 0, universe),
+            cls.dmp.pack(0x7000 | (cls.dmp.size + len(channels)), 0x02, 0xa1, 0, 1,
+                         len(channels) + 1, 0),
+            bytes(channels)))
+
+    @classmethod
+    def sync_packet(cls, sequence, sync_address):
+        root_length = cls.root.size - 16 + cls.sync_framing.size
+        return (cls.root.pack(0x10, 0, cls.acn_id, 0x7000 | root_length,
+                              cls.vector_extended, b'\x00' * 16) +
+                cls.sync_framing.pack(0x7000 | cls.sync_framing.size, cls.vector_sync,
+                                      sequence, sync_address, 0))
+
+
+class ArtNetProgram(DmxProgram):
+    """Receives Art-Net ArtDmx packets.
+
+    Once an ArtSync has been received, universes are held until the next
+    one, so a frame split over several universes is shown all at once; after
+    sync_timeout seconds without one every universe is shown as it arrives
+    again.
+    """
+    port = 6454
+    first_universe = 0
+    sync_timeout = 4
+    header = struct.Struct('<8sHH')
+    dmx = struct.Struct('>BBHH')
+    op_dmx = 0x5000
+    op_sync = 0x5200
+    art_net = b'Art-Net\x00'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.synced_until = float('-inf')
+
+    def handle_packet(self, data):
+        if len(data) < self.header.size:
+            return False
+        art_net, opcode, _ = self.header.unpack_from(data)
+        if art_net != self.art_net:
+            return False
+        if opcode == self.op_sync:
+            self.synced_until = time.monotonic() + self.sync_timeout
+            render, self.pending = self.pending, False
+            return render
+        if opcode != self.op_dmx or len(data) < self.header.size + self.dmx.size:
+            return False
+        sequence, _, universe, length = self.dmx.unpack_from(data, self.header.size)
+        # port-address is little-endian, unlike the rest of the ArtDmx fields
+        universe = ((universe & 0xff) << 8) | (universe >> 8)
+        if sequence and not self.in_sequence(universe, sequence):
+            return False
+        start = self.header.size + self.dmx.size
+        if not self.set_universe(universe, data[start:start + length]):
+            return False
+        if time.monotonic() < self.synced_until:
+            self.pending = True
+            return False
+        return True
+
+    @classmethod
+    def packet(cls, universe, sequence, channels):
+        """Build an ArtDmx packet carrying channels."""
+        return (cls.header.pack(cls.art_net, cls.op_dmx, 0x0e00) +
+                cls.dmx.pack(sequence, 0, ((universe & 0xff) << 8) | (universe >> 8),
+                             len(channels)) +
+                bytes(channels))
+
+    @classmethod
+    def sync_packet(cls):
+        return cls.header.pack(cls.art_net, cls.op_sync, 0x0e00) + b'\x00\x00'
 
 
 class ProgramRunnerThread(threading.Thread):
@@ -463,38 +1789,701 @@ class ProgramRunnerThread(threading.Thread):
                 self.program.run()
         except LedExit:
             pass
-        finally:
-            del self._target, self._args, self._kwargs
-            time.sleep(0.1)
 
-    def stop(self):
+    def stop(self, timeout=None):
+        """Ask the program to stop and wait up to timeout seconds for it to."""
         self.program.stop()
         self.exit_requested = True
-        self.join()
+        self.join(timeout)
+        if self.is_alive():
+            # it will raise LedExit on its next show() if it ever gets there
+            logger.warning("{} did not stop within {}s, abandoning it".format(
+                type(self.program).__name__, timeout))
+
+
+class Compositor:
+    """Blends the visible frames, lowest priority first, into one output frame.
+
+    Blending works on whole buffers at once, treating each byte of the packed
+    colours as a channel.
+    """
+    fade_interval = 0.02
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.accumulator = np.zeros((pixels, 4), dtype=np.float32)
+        self.output = np.zeros(pixels, dtype=np.uint32)
+
+    @staticmethod
+    def layers(frames, now):
+        """(frame, alpha) pairs to draw, bottom first.
+
+        Frames hidden under an opaque 'over' frame are left out.
+        """
+        layers = []
+        for frame in sorted(frames, key=lambda f: f.priority, reverse=True):
+            alpha = frame.alpha(now)
+            if alpha <= 0:
+                continue
+            layers.append((frame, alpha))
+            if alpha >= 1 and frame.blend == 'over':
+                break
+        layers.reverse()
+        return layers
+
+    def composite(self, layers, start=0, stop=None):
+        """Blend layers into output between pixels start and stop."""
+        if stop is None:
+            stop = self.pixels
+        output = self.output[start:stop]
+        if len(layers) == 1 and layers[0][1] >= 1 and layers[0][0].blend == 'over':
+            # the common case of one opaque frame is a straight copy
+            colours = layers[0][0].data2[start:stop]
+            output[:len(colours)] = colours
+            output[len(colours):] = 0
+            return self.output
+        accumulator = self.accumulator[start:stop]
+        accumulator.fill(0)
+        for frame, alpha in layers:
+            colours = frame.data2[start:stop].view(np.uint8).reshape(-1, 4)
+            dst = accumulator[:len(colours)]
+            blended = blend_modes[frame.blend](dst, colours.astype(np.float32))
+            if alpha >= 1:
+                dst[:] = blended
+            else:
+                dst += (blended - dst) * alpha
+        channels = output.view(np.uint8).reshape(-1, 4)
+        np.copyto(channels, accumulator + 0.5, casting='unsafe')
+        return self.output
+
+
+class OutputBackend:
+    """Somewhere the Renderer can send finished frames.
+
+    write() receives the corrected colours for the span starting at start,
+    and show() is called once per rendered frame after the writes for it.
+    """
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def begin(self):
+        pass
+
+    def write(self, colours, start=0):
+        raise NotImplementedError()
+
+    def show(self):
+        pass
+
+
+class NeoPixelBackend(OutputBackend):
+    """A WS281x strip driven by rpi_ws281x."""
+    def __init__(self, pixels, pin=18, freq=800000, dma=5, invert=False, brightness=255,
+                 channel=0):
+        super().__init__(pixels)
+        self.settings = (pin, freq, dma, invert, brightness, channel)
+        self.strip = None
+
+    def begin(self):
+        if neopixel is None:
+            raise RuntimeError("the neopixel module is needed to drive a strip")
+        # Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT,
+        #                   LED_BRIGHTNESS, LED_CHANNEL)
+        self.strip = neopixel.Adafruit_NeoPixel(self.pixels, *self.settings)
+        self.strip.begin()
+
+    def write(self, colours, start=0):
+        upload(self.strip, colours, start)
+
+    def show(self):
+        self.strip.show()
+
+
+class NullBackend(OutputBackend):
+    """Discards frames, counting them, for running without hardware."""
+    def __init__(self, pixels):
+        super().__init__(pixels)
+        self.frames_shown = 0
+
+    def write(self, colours, start=0):
+        pass
+
+    def show(self):
+        self.frames_shown += 1
+
+
+class SimulatedStripBackend(NullBackend):
+    """Discards frames but takes as long to show them as a WS281x strip.
+
+    Each pixel takes 30us to clock out at 800kHz, plus the latch time.
+    """
+    pixel_time = 30e-6
+    latch_time = 300e-6
+
+    def show(self):
+        time.sleep(self.pixels * self.pixel_time + self.latch_time)
+        super().show()
+
+
+Segment = collections.namedtuple('Segment', 'backend start stop offset reverse')
+
+
+class SplitBackend(OutputBackend):
+    """One logical strip spread across several outputs.
+
+    Each segment sends logical pixels [start, stop) to its backend starting
+    at pixel offset there, reversed for strips wired back towards the
+    start. show() presents every output that was written to at once, each
+    on a thread of its own, and returns once they have all finished, so a
+    frame is never shown half on one output and half on another.
+    """
+    def __init__(self, segments):
+        self.segments = [Segment(backend, start, stop, offset, reverse)
+                         for backend, start, stop, offset, reverse in segments]
+        self.backends = []
+        for segment in self.segments:
+            if segment.backend not in self.backends:
+                self.backends.append(segment.backend)
+        super().__init__(max(segment.stop for segment in self.segments))
+        self.written = set()
+        self.presenters = []
+
+    @classmethod
+    def chain(cls, backends):
+        """Split across backends end to end, in order."""
+        segments = []
+        start = 0
+        for backend in backends:
+            segments.append((backend, start, start + backend.pixels, 0, False))
+            start += backend.pixels
+        return cls(segments)
+
+    def begin(self):
+        for backend in self.backends:
+            backend.begin()
+        self.present = threading.Barrier(len(self.backends) + 1)
+        self.presented = threading.Barrier(len(self.backends) + 1)
+        for backend in self.backends:
+            presenter = threading.Thread(target=self.presenter, args=(backend,))
+            presenter.daemon = True
+            presenter.start()
+            self.presenters.append(presenter)
+
+    def write(self, colours, start=0):
+        stop = start + len(colours)
+        for segment in self.segments:
+            first, last = max(start, segment.start), min(stop, segment.stop)
+            if first >= last:
+                continue
+            chunk = colours[first - start:last - start]
+            if segment.reverse:
+                offset = segment.offset + segment.stop - last
+                chunk = chunk[::-1]
+            else:
+                offset = segment.offset + first - segment.start
+            segment.backend.write(chunk, offset)
+            self.written.add(segment.backend)
+
+    def show(self):
+        self.present.wait()
+        self.presented.wait()
+        self.written.clear()
+
+    def presenter(self, backend):
+        while True:
+            self.present.wait()
+            try:
+                if backend in self.written:
+                    backend.show()
+            except Exception:
+                logger.exception("Exception showing {}".format(type(backend).__name__))
+            self.presented.wait()
+
+
+class UdpBackend(OutputBackend):
+    """Streams frames to remote controllers in the format ServerProgram reads.
+
+    A frame that fits in one datagram is sent as 0x03, and a bigger one as a
+    run of 0x05 packets ending with a 0x04. With fragments set, frames go as
+    0x06 fragments, which the receiver only shows once all have arrived.
+    With delta set only the packets covering pixels changed since the last
+    frame are sent, plus the whole frame every keyframe_interval seconds in
+    case any were lost.
+
+    Packets split the frame at fixed pixel boundaries and their buffers,
+    headers included, are allocated once in begin(), so a frame is encoded
+    straight into them and sent from one socket to every endpoint.
+    """
+    max_payload = 1400
+    keyframe_interval = 1.0
+
+    def __init__(self, pixels, endpoints, fragments=False, delta=False):
+        super().__init__(pixels)
+        self.endpoints = list(endpoints)
+        self.fragments = fragments
+        self.delta = delta
+        self.data = np.zeros(pixels, dtype=np.uint32)
+        self.dirty_start, self.dirty_stop = pixels, 0
+        self.keyframe = float('-inf')
+        self.sequence = 0
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_dropped = 0
+
+    def begin(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        header = FrameAssembler.header.size if self.fragments else 3
+        self.per_packet = (self.max_payload - header) // 3
+        self.packets = []
+        for start in range(0, self.pixels, self.per_packet):
+            stop = min(start + self.per_packet, self.pixels)
+            packet = bytearray(header + (stop - start) * 3)
+            if not self.fragments:
+                packet[1:3] = start.to_bytes(2, 'big')
+            rgb = np.frombuffer(packet, dtype=np.uint8, offset=header).reshape(-1, 3)
+            self.packets.append((packet, rgb, start, stop))
+        self.frame_packet = None
+        if not self.fragments and 1 + self.pixels * 3 <= self.max_payload:
+            self.frame_packet = bytearray(1 + self.pixels * 3)
+            self.frame_packet[0] = 0x03
+            self.frame_rgb = np.frombuffer(self.frame_packet, dtype=np.uint8,
+                                           offset=1).reshape(-1, 3)
+        telemetry.gauge('udp_out', lambda: {
+            'packets': self.packets_sent, 'bytes': self.bytes_sent,
+            'dropped': self.packets_dropped})
+
+    def write(self, colours, start=0):
+        stop = start + len(colours)
+        self.data[start:stop] = colours
+        self.dirty_start = min(self.dirty_start, start)
+        self.dirty_stop = max(self.dirty_stop, stop)
+
+    def show(self):
+        start, stop = self.dirty_start, self.dirty_stop
+        self.dirty_start, self.dirty_stop = self.pixels, 0
+        now = time.monotonic()
+        if not self.delta or now - self.keyframe >= self.keyframe_interval:
+            start, stop = 0, self.pixels
+            self.keyframe = now
+        if start >= stop:
+            return
+        if self.frame_packet is not None and stop - start == self.pixels:
+            encode_rgb(self.data, self.frame_rgb)
+            self.send(self.frame_packet)
+            return
+        packets = self.packets[start // self.per_packet:(stop - 1) // self.per_packet + 1]
+        self.sequence = (self.sequence + 1) & 0xffff
+        for index, (packet, rgb, first, last) in enumerate(packets):
+            encode_rgb(self.data[first:last], rgb)
+            if self.fragments:
+                FrameAssembler.header.pack_into(packet, 0, 0x06, self.sequence, index,
+                                                len(packets), first)
+            else:
+                packet[0] = 0x04 if index == len(packets) - 1 else 0x05
+            self.send(packet)
+
+    def send(self, packet):
+        # Python has no sendmmsg(), so this is one sendto() per packet and endpoint
+        for endpoint in self.endpoints:
+            try:
+                self.sock.sendto(packet, endpoint)
+            except BlockingIOError:
+                self.packets_dropped += 1
+            else:
+                self.packets_sent += 1
+                self.bytes_sent += len(packet)
+
+
+class RecordingBackend(OutputBackend):
+    """Keeps a copy of the strip contents, and optionally of every frame shown."""
+    def __init__(self, pixels, keep=0):
+        super().__init__(pixels)
+        self.data = np.zeros(pixels, dtype=np.uint32)
+        self.frames = collections.deque(maxlen=keep)
+
+    def write(self, colours, start=0):
+        self.data[start:start + len(colours)] = colours
+
+    def show(self):
+        if self.frames.maxlen:
+            self.frames.append(self.data.copy())
 
 
 class Renderer(threading.Thread):
+    """Composites the visible frames and renders them to an output backend.
+
+    Sleeps on render_condition until a frame is shown, a frame times out or
+    a fade needs its next step, and only then recomposites. When the visible
+    layers are unchanged only the span of pixels their shows changed is
+    recomposited and written to the backend.
+    """
     frames = []
 
+    def __init__(self, backend=None):
+        super().__init__()
+        if backend is None:
+            backend = NeoPixelBackend(pixels)
+        self.backend = backend
+        self.compositor = Compositor(backend.pixels)
+        self.shown = None
+        self.lut = colour_lut
+        self.frames_rendered = 0
+        self.pixels_written = 0
+        # perf_counter() of the oldest change in the last render
+        self.changed_at = None
+        telemetry.gauge('render', self.render_stats)
+
+    def next_change(self, now):
+        changes = [frame.next_change(now) for frame in self.frames]
+        changes = [change for change in changes if change is not None]
+        return min(changes, default=None)
+
+    def render(self, now):
+        """Composite and write out whatever has changed since the last render.
+
+        Must be called with render_condition held. Returns False if there was
+        nothing to draw, otherwise the caller should show() the backend.
+        """
+        layers = self.compositor.layers(self.frames, now)
+        shown = [(id(frame), alpha) for frame, alpha in layers]
+        changes = {frame: frame.take_changes() for frame in self.frames}
+        if shown != self.shown or self.lut is not colour_lut:
+            start, stop = 0, self.compositor.pixels
+        else:
+            start = min((changes[frame][0] for frame, alpha in layers), default=0)
+            stop = max((changes[frame][1] for frame, alpha in layers), default=0)
+            stop = min(stop, self.compositor.pixels)
+        if not layers:
+            if not self.shown:
+                return False
+            # the last layer has just gone, so clear whatever it left behind
+            start, stop = 0, self.compositor.pixels
+        elif start >= stop:
+            return False
+        self.changed_at = min((changes[frame][2] for frame, alpha in layers
+                               if changes[frame][2] is not None), default=None)
+        self.shown = shown
+        self.lut = colour_lut
+        output = self.compositor.composite(layers, start, stop)
+        self.backend.write(correct_colours(output[start:stop]), start)
+        self.frames_rendered += 1
+        self.pixels_written += stop - start
+        return True
+
+    def render_stats(self):
+        # shows skipped as unchanged, for each frame in self.frames order
+        return {'frames': self.frames_rendered, 'pixels': self.pixels_written,
+                'skipped': [frame.frames_skipped for frame in self.frames]}
+
     def run(self):
-        # Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS)
-        self.strip = neopixel.Adafruit_NeoPixel(pixels, 18, 800000, 5, False, 255)
-        self.strip.begin()
+        self.backend.begin()
+        while True:
+            with render_condition:
+                # fades step on a fixed grid rather than on every wakeup
+                now = time.monotonic()
+                now -= now % Compositor.fade_interval
+                # composite under the lock so show() can't swap data2 meanwhile
+                started = time.perf_counter()
+                if not self.render(now):
+                    render_condition.wait(self.next_change(now))
+                    continue
+            self.backend.show()
+            self.shown_frame(started)
+
+    def shown_frame(self, started):
+        now = time.perf_counter()
+        telemetry.record('render.ms', (now - started) * 1000)
+        if self.changed_at is not None:
+            telemetry.record('render.latency_ms', (now - self.changed_at) * 1000)
+
+
+class SharedFrame:
+    """A frame's pixels in shared memory, guarded by a seqlock.
+
+    The writer makes the sequence number odd while it copies pixels in and
+    even again once it's done, so a reader that sees the same even number
+    before and after its copy knows it wasn't torn. The span the last
+    publish wrote is kept alongside.
+    """
+    header_size = 16
+
+    def __init__(self, pixels, name=None):
+        size = self.header_size + pixels * 4
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.pixels = pixels
+        self.sequence = np.ndarray(1, dtype=np.uint64, buffer=self.memory.buf)
+        self.span = np.ndarray(2, dtype=np.uint32, buffer=self.memory.buf, offset=8)
+        self.data = np.ndarray(pixels, dtype=np.uint32, buffer=self.memory.buf,
+                               offset=self.header_size)
+
+    def publish(self, colours, start, stop):
+        """Write colours[start:stop] into the shared frame."""
+        self.sequence[0] += 1
+        self.span[:] = start, stop
+        self.data[start:stop] = colours[start:stop]
+        self.sequence[0] += 1
+
+    def read(self, into, since, timeout=0.1, alive=None):
+        """Copy whatever was published after sequence number since into an array.
+
+        Returns the new sequence number and the [start, stop) span copied,
+        or None if no consistent copy could be made within timeout seconds
+        or alive() says the writer has gone, e.g. having died partway
+        through a publish.
+        """
+        deadline = time.monotonic() + timeout
         while True:
-            for frame in self.frames:
-                if frame.active():
-                    frame.render_strip(self.strip)
+            sequence = int(self.sequence[0])
+            if sequence & 1:
+                if time.monotonic() > deadline or (alive is not None and not alive()):
+                    return None
+                time.sleep(0)
+                continue
+            if sequence == since:
+                return sequence, 0, 0
+            elif sequence == since + 2:
+                start, stop = (int(i) for i in self.span)
+            else:
+                # missed a publish, so its span is lost
+                start, stop = 0, self.pixels
+            into[start:stop] = self.data[start:stop]
+            if int(self.sequence[0]) == sequence:
+                return sequence, start, stop
+            if time.monotonic() > deadline:
+                return None
+
+    def close(self):
+        del self.sequence, self.span, self.data
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+def run_isolated(program_class, args, kwargs, zone, values, shared_name, pixel_count,
+                 connection, updates, heartbeat):
+    """The child process side of IsolatedProgram.
+
+    Runs the program into a private Frame, publishing each shown frame to the
+    shared frame and telling the parent over connection: 1 for a show, 0 for
+    a heartbeat, sent at least every heartbeat seconds while it's healthy.
+    """
+    shared = SharedFrame(pixel_count, shared_name)
+    frame = Frame(pixel_count)
+    program = program_class(frame, *args, zone=zone, **kwargs)
+    program.prepare()
+    for name, value in values.items():
+        setattr(program, name, value)
+    last_write = frame.last_write
+    try:
+        for interval in program.steps():
+            while True:
+                try:
+                    name, value = updates.get_nowait()
+                except queue.Empty:
                     break
+                setattr(program, name, value)
+            if frame.last_write == last_write:
+                connection.send_bytes(b'\x00')
+            else:
+                last_write = frame.last_write
+                start, stop, changed_at = frame.take_changes()
+                if start < stop:
+                    shared.publish(frame.data2, start, stop)
+                connection.send_bytes(b'\x01')
+            deadline = program.clock.next_deadline(interval)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if remaining > heartbeat:
+                    time.sleep(heartbeat)
+                    connection.send_bytes(b'\x00')
+                else:
+                    time.sleep(remaining)
+    except (LedExit, BrokenPipeError):
+        pass
+    finally:
+        shared.close()
+
+
+class IsolatedProgram(threading.Thread):
+    """Runs a copy of a program in a child process and shows what it draws.
+
+    The child draws into a SharedFrame, and this thread copies each frame it
+    publishes into the program's Frame. If the child crashes, or goes
+    stall_timeout seconds without a heartbeat, it is killed, given
+    kill_timeout seconds to die after SIGTERM before SIGKILL, and restarted
+    a second later with the program's current parameters.
+    """
+    context = multiprocessing.get_context('spawn')
+    heartbeat = 0.5
+    start_timeout = 10
+    stall_timeout = 2
+    kill_timeout = 0.5
+
+    def __init__(self, program):
+        super().__init__()
+        self.program = program
+        self.exit_event = threading.Event()
+        self.lock = threading.Lock()
+        self.updates = self.context.Queue()
+        self.process = None
+        self.frames = 0
+        self.restarts = 0
+
+    def update(self, name, value):
+        self.updates.put((name, value))
+
+    def stop(self):
+        with self.lock:
+            self.exit_event.set()
+            process = self.process
+        if process is not None:
+            process.terminate()
+
+    def stats(self):
+        return {'frames': self.frames, 'restarts': self.restarts,
+                'pid': self.process and self.process.pid}
+
+    def run(self):
+        name = type(self.program).__name__
+        while not self.exit_event.is_set():
+            self.spawn()
+            try:
+                finished = self.watch(name)
+            except Exception:
+                logger.exception("Exception watching {}".format(name))
+                finished = False
+            finally:
+                self.reap()
+            if finished or self.exit_event.is_set():
+                return
+            self.restarts += 1
+            telemetry.count('isolated.restarts')
+            self.exit_event.wait(1)
+
+    def spawn(self):
+        program = self.program
+        zone = None if program.zone is None else get_zone(program.zone)
+        self.shared = SharedFrame(program.pixel_count)
+        # read into outside the lock, so a stuck read can't block stop()
+        self.staging = np.zeros(program.pixel_count, dtype=np.uint32)
+        self.sequence = 0
+        self.connection, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_isolated, daemon=True,
+            args=(type(program), program.args, program.kwargs, zone,
+                  program.parameter_values(), self.shared.name, program.pixel_count,
+                  sender, self.updates, self.heartbeat))
+        process.start()
+        sender.close()
+        with self.lock:
+            self.process = process
+        if self.exit_event.is_set():
+            process.terminate()
+
+    def watch(self, name):
+        """Show frames until the child exits or stalls. Returns True if the
+        program finished by itself."""
+        timeout = self.start_timeout
+        while not self.exit_event.is_set():
+            if not self.connection.poll(timeout):
+                logger.warning("{} stalled for {}s, restarting".format(name, timeout))
+                return False
+            timeout = self.stall_timeout
+            shown = False
+            try:
+                while self.connection.poll(0):
+                    shown = self.connection.recv_bytes() == b'\x01' or shown
+            except EOFError:
+                self.process.join(self.kill_timeout)
+                if self.process.exitcode == 0 or self.exit_event.is_set():
+                    logger.info("{} finished".format(name))
+                    return True
+                logger.warning("{} exited with {}, restarting".format(name, self.process.exitcode))
+                return False
+            if shown and not self.present():
+                logger.warning("{} left a frame half published, restarting".format(name))
+                return False
+        return True
+
+    def present(self):
+        """Show the child's latest frame, returning False if it couldn't be read."""
+        program = self.program
+        frame = program.frame
+        read = self.shared.read(self.staging, self.sequence, alive=self.process.is_alive)
+        if read is None:
+            return False
+        self.sequence, start, stop = read
+        with self.lock:
+            if self.exit_event.is_set():
+                return True
+            if start < stop:
+                frame.data[start:stop] = self.staging[start:stop]
+                frame.mark_dirty(start, stop)
+            frame.show()
+        self.frames += 1
+        if program.switch_requested is not None:
+            logger.info("{} showing first frame {:.1f}ms after it was requested".format(
+                type(program).__name__, (time.monotonic() - program.switch_requested) * 1000))
+            program.switch_requested = None
+        return True
+
+    def reap(self):
+        process = self.process
+        process.terminate()
+        process.join(self.kill_timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self.connection.close()
+        self.shared.close()
+        self.shared.unlink()
 
 
 class MainLedThread(threading.Thread):
-    def __init__(self):
+    """The animation worker: steps the selected program on one long-lived thread.
+
+    Jobs posted to task_queue, such as switching program or changing one of
+    its parameters, run on this thread between frames, so a switch takes
+    effect at the next frame boundary and no frame is drawn with a
+    half-applied update.
+
+    With isolate set, programs that allow it run in an IsolatedProgram
+    rather than being stepped here.
+    """
+    def __init__(self, cache=None, isolate=False):
         super().__init__()
-        self.progthread = None
+        self.program = None
+        self.steps = None
+        self.isolate = isolate
+        self.isolated = None
+        self.deadline = None
         self.task_queue = queue.Queue()
+        self.cache = cache
+        telemetry.gauge('program', self.program_stats)
+        telemetry.gauge('queue.main', self.task_queue.qsize)
 
     def post(self, job):
-        self.task_queue.put(job)
+        self.queue_job(self.select, job, time.monotonic())
+
+    def update(self, program, name, value):
+        """Set an attribute of program between frames."""
+        self.queue_job(self.set_parameter, program, name, value)
+
+    def set_parameter(self, program, name, value):
+        setattr(program, name, value)
+        if self.isolated is not None and self.isolated.program is program:
+            self.isolated.update(name, value)
+
+    def queue_job(self, job, *args):
+        self.task_queue.put((job, args))
 
     def run(self):
         while True:
@@ -502,64 +2491,169 @@ class MainLedThread(threading.Thread):
                 self.loop()
             except Exception as e:
                 logger.exception("Exception in MainLedThread: %s", e)
+                self.program = self.steps = None
                 time.sleep(1)
 
     def loop(self):
         while True:
             try:
-                program = self.task_queue.get(timeout=0.1)
+                job, args = self.task_queue.get(timeout=self.timeout())
             except queue.Empty:
-                continue
+                self.step()
+            else:
+                job(*args)
 
-            logger.info("new program requested")
+    def timeout(self):
+        """Seconds until the next frame is due, or None with no program running."""
+        if self.steps is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
 
-            if self.progthread is not None:
-                logger.info("stopping old program")
-                self.progthread.stop()
-                logger.info("old program stopped")
+    def run_pending(self):
+        """Run every queued job without waiting for more."""
+        while True:
+            try:
+                job, args = self.task_queue.get_nowait()
+            except queue.Empty:
+                return
+            job(*args)
 
-            self.progthread = ProgramRunnerThread()
-            self.progthread.program = program
-            self.progthread.daemon = True
-            self.progthread.start()
-            logger.info("new program started")
+    def step(self):
+        started = time.perf_counter()
+        try:
+            interval = next(self.steps)
+        except (StopIteration, LedExit):
+            logger.info("{} finished".format(type(self.program).__name__))
+            self.program = self.steps = None
+            return
+        telemetry.record('program.frame_ms', (time.perf_counter() - started) * 1000)
+        self.deadline = self.program.clock.next_deadline(interval)
+
+    def program_stats(self):
+        program = self.program
+        if program is None:
+            return None
+        if self.isolated is not None:
+            return dict(self.isolated.stats(), name=type(program).__name__)
+        return dict(program.stats(), name=type(program).__name__)
+
+    def select(self, program, requested):
+        logger.info("new program requested")
+        # set up the new program while the old one's last frame is showing
+        program.switch_requested = requested
+        program.prepare()
+        if self.steps is not None:
+            self.steps.close()
+            self.steps = None
+        if self.isolated is not None:
+            self.isolated.stop()
+            self.isolated = None
+        self.program = program
+        if self.cache is not None and self.cache.cacheable(program):
+            self.steps = self.cache.playback(program)
+            # start recording before the first frame is due
+            self.cache.get(program)
+        elif self.isolate and program.isolatable:
+            self.isolated = IsolatedProgram(program)
+            self.isolated.daemon = True
+            self.isolated.start()
+        else:
+            self.steps = program.steps()
+        self.deadline = time.monotonic()
+        logger.info("new program started")
 
 
 def on_connect(client, userdata, flags, rc):
     logger.info("mqtt connected")
-    client.subscribe("display/g1/leds")
-    client.subscribe("display/g1/leds/brightness")
-    client.subscribe("display/g1/leds/rainbow/multiplier")
-    client.subscribe("display/g1/leds/rainbow/speed")
-    client.subscribe("display/g1/leds/chase/speed")
-    client.subscribe("display/g1/leds/chase/pixels")
-    client.subscribe("display/g1/leds/picker")
-    client.subscribe("display/g1/leds/picker/json")
+    client.subscribe(TopicRouter(MessageHandler.prefix).subscription())
+    sensors.connected(client)
+
+
+class TopicRouter:
+    """Maps the MQTT topics under prefix to their handlers.
+
+    Routes are registered up front by subtopic and dispatched with a single
+    dict lookup on the full topic, so one wildcard subscription covers them
+    all. A handler of None means the topic is known but ignored.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.routes = {}
+
+    def add(self, subtopic, handler):
+        """Route prefix/subtopic, or prefix itself for '', to handler(message)."""
+        topic = self.prefix + '/' + subtopic if subtopic else self.prefix
+        self.routes[topic] = handler
+
+    def subscription(self):
+        return self.prefix + '/#'
 
 
 class MessageHandler:
-    prefix = 'display/g1/leds/'
+    prefix = 'display/g1/leds'
 
-    def __init__(self, main_led_thread):
+    def __init__(self, main_led_thread, library=None):
         self.main_led_thread = main_led_thread
+        self.library = presets if library is None else library
+        self.router = self.build_router()
+        self.library.listeners.append(self.presets_changed)
+
+    def build_router(self):
+        router = TopicRouter(self.prefix)
+        router.add('', self.on_root)
+        router.add('brightness', self.on_brightness)
+        router.add('picker', self.on_picker)
+        router.add('picker/json', self.on_picker_json)
+        router.add('picker/bin', self.on_picker_bin)
+        # our own telemetry, published under the same prefix
+        router.routes[StatsPublisher.topic] = None
+        for name, definition in self.library.definitions.items():
+            self.add_parameters(router, name, definition.program)
+        return router
+
+    def add_parameters(self, router, name, program_class):
+        """Route name/<parameter> to an update of each of the preset's parameters,
+        and name/<alias> for each of its parameter_aliases."""
+        subtopics = {parameter: parameter for parameter in program_class.parameters}
+        subtopics.update(program_class.parameter_aliases)
+        for subtopic, parameter in subtopics.items():
+            router.add(name + '/' + subtopic,
+                       self.parameter_handler(name, program_class, parameter))
+
+    def parameter_handler(self, name, program_class, parameter):
+        parse = program_class.parameters[parameter]
+
+        def handler(message):
+            value = parse(message.payload)
+            self.main_led_thread.update(self.library[name], parameter, value)
+            logger.info("{} {} set to {}".format(name, parameter, value))
+        return handler
+
+    def presets_changed(self, replaced):
+        """Rebuild the routes after presets were reloaded, and restart the
+        running program if its preset was one of them."""
+        self.router = self.build_router()
+        running = self.main_led_thread.program
+        for name, program in replaced.items():
+            if program is not None and program is running and name in self.library:
+                logger.info("restarting reloaded preset {}".format(name))
+                self.main_led_thread.post(self.library[name])
 
     def on_message(self, client, userdata, message):
         logger.debug('Received message: %s\t%s', message.topic, message.payload)
-
-        def to_name(topic):
-            extension = topic[len(self.prefix):]
-            if extension == '':
-                return 'on_root'
-            return 'on_' + extension.replace('/', '_')
-        name = to_name(message.topic)
-
-        handler = getattr(self, name)
         try:
-            handler(message)
+            if sensors.update(message.topic, message.payload):
+                return
+            if message.topic not in self.router.routes:
+                logger.debug('No handler for topic {}'.format(message.topic))
+                return
+            handler = self.router.routes[message.topic]
+            if handler is not None:
+                handler(message)
         except ValueError:
-            logger.exception('{} could not be parsed: {}'.format(name, message.payload))
+            logger.exception('{} could not be parsed: {}'.format(message.topic, message.payload))
         except Exception as e:
-            logger.exception("Exception ({}) handling topic {}".format(e.message, message.topic))
+            logger.exception("Exception ({}) handling topic {}".format(e, message.topic))
 
     def on_root(self, message):
         try:
@@ -567,9 +2661,9 @@ class MessageHandler:
         except ValueError:
             data = message.payload.decode()
 
-        if data in presets:
+        if data in self.library:
             logger.info("selecting preset {}".format(data))
-            self.main_led_thread.post(presets[data])
+            self.main_led_thread.post(self.library[data])
         else:
             rgb = parse_colour(data)
             if rgb is None:
@@ -580,63 +2674,925 @@ class MessageHandler:
                 self.main_led_thread.post(p)
 
     def on_brightness(self, message):
-        global brightness_pct
         payload = int(message.payload)
         if payload >= 0 and payload <= 100:
-            brightness_pct = payload
+            set_brightness(payload)
             logger.info("LED brightness set to {}%".format(brightness_pct))
         else:
             logger.warning("Brightness value {} was outside of bounds".format(payload))
 
-    def on_rainbow_multiplier(self, message):
-        presets["rainbow"].multiplier = float(message.payload)
-        logger.info("rainbow multiplier set to {}".format(presets["rainbow"].multiplier))
-
-    def on_rainbow_speed(self, message):
-        presets["rainbow"].speed = float(message.payload)
-        logger.info("rainbow speed set to {}".format(presets["rainbow"].speed))
-
-    def on_chase_speed(self, message):
-        presets["chase"].speed = float(message.payload)
-        logger.info("chase speed set to {}".format(presets["chase"].speed))
-
-    def on_chase_pixels(self, message):
-        presets["chase"].n = int(message.payload)
-        logger.info("chase pixels set to {}".format(presets["chase"].n))
-
     def on_picker(self, message):
-            presets["pixelpicker"].chosen_pixel = int(message.payload)
+            self.main_led_thread.update(self.library["pixelpicker"], "chosen_pixel",
+                                        int(message.payload))
             logger.info("pixel number {} chosen".format(int(message.payload)))
 
     def on_picker_json(self, message):
             data = json.loads(message.payload.decode())
-            presets["pixelpicker"].post(data)
-
-
-frame_net = Frame(776, timeout=1)
-frame_music = Frame(776, timeout=1)
-frame_main = Frame(776, timeout=5)
-frame_fallback = Frame(776)
-
-presets = {
-    "rainbow": Rainbow(frame_main),
-    "zap": Zap(frame_main),
-    "test": TestChecker(frame_main),
-    "chase": Chase(frame_main),
-    "projector": ProjectorBow(frame_main),
-    "emergency": Emergency(frame_main),
-    "emergency2": Emergency2(frame_main),
-    "bercostat": Bercostat(frame_main),
-    "bercostatbow": BercostatBow(frame_main),
-    "dimrainbow": DimRainbow(frame_main),
-    "pixelpicker": PixelPicker(frame_main)
-}
+            self.library["pixelpicker"].post(data)
+
+    def on_picker_bin(self, message):
+        self.library["pixelpicker"].post(message.payload)
+
+
+# resized in main() to match the outputs
+frame_net = Frame(pixels, timeout=1, priority=2, fade=0.5)
+frame_music = Frame(pixels, timeout=1, priority=1, fade=0.5)
+frame_main = Frame(pixels, timeout=5, priority=0)
+frame_fallback = Frame(pixels)
+
+PresetDefinition = collections.namedtuple('PresetDefinition',
+                                          'program args kwargs zone parameters',
+                                          defaults=((), {}, None, {}))
+
+
+class PresetLibrary:
+    """Presets by name: the built in ones plus one JSON file each in path.
+
+    A file's name, less .json, names its preset, which may replace a built
+    in one, and it holds the program class name and optionally its args,
+    kwargs, zone and starting parameter values, e.g. {"program": "Chase",
+    "kwargs": {"n": 7}, "parameters": {"speed": 2}}.
+    refresh() parses files that are new or whose mtime or size changed, so
+    the library is only read once however large it grows, and a program is
+    only created the first time its preset is looked up. Listeners are
+    called with {name: replaced program or None} after a refresh changes
+    anything.
+    """
+    def __init__(self, frame, builtins, path=None):
+        self.frame = frame
+        self.builtins = dict(builtins)
+        self.path = path
+        self.definitions = dict(builtins)
+        self.instances = {}
+        self.files = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+    def __getitem__(self, name):
+        with self.lock:
+            try:
+                return self.instances[name]
+            except KeyError:
+                pass
+            definition = self.definitions[name]
+            program = definition.program(self.frame, *definition.args, zone=definition.zone,
+                                         values=definition.parameters, **definition.kwargs)
+            self.instances[name] = program
+            return program
+
+    def items(self):
+        """Every preset and its program, creating any not looked up yet."""
+        return [(name, self[name]) for name in list(self.definitions)]
+
+    keys = {'program', 'args', 'kwargs', 'zone', 'parameters'}
+
+    def parse(self, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        unknown = set(data) - self.keys
+        if unknown:
+            raise ValueError("unknown keys {}".format(', '.join(sorted(unknown))))
+        program = globals().get(data['program'])
+        # only animations, whose loop() yields between frames; the servers'
+        # loop() blocks and would hang the animation worker
+        if not (isinstance(program, type) and issubclass(program, LedProgram) and
+                inspect.isgeneratorfunction(program.loop)):
+            raise ValueError("{} is not an animation program".format(data['program']))
+        zone = data.get('zone')
+        if zone is not None:
+            get_zone(zone)
+        parameters = {}
+        for name, value in data.get('parameters', {}).items():
+            name = program.parameter_aliases.get(name, name)
+            if name not in program.parameters:
+                raise ValueError("{} has no parameter {}".format(program.__name__, name))
+            parameters[name] = program.parameters[name](value)
+        return PresetDefinition(program, tuple(data.get('args', ())),
+                                dict(data.get('kwargs', {})), zone, parameters)
+
+    def refresh(self):
+        """Load preset files that have appeared or changed since the last call,
+        and forget those that have gone."""
+        if self.path is None:
+            return
+        try:
+            entries = [entry for entry in os.scandir(self.path)
+                       if entry.name.endswith('.json') and entry.is_file()]
+        except FileNotFoundError:
+            entries = []
+        changed = {}
+        seen = set()
+        for entry in entries:
+            name = entry.name[:-len('.json')]
+            seen.add(name)
+            stat = entry.stat()
+            version = (stat.st_mtime_ns, stat.st_size)
+            if self.files.get(name) == version:
+                continue
+            self.files[name] = version
+            try:
+                definition = self.parse(entry.path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("preset {} not loaded: {}".format(entry.path, e))
+                continue
+            if self.definitions.get(name) != definition:
+                logger.info("loaded preset {}".format(name))
+                changed[name] = self.replace(name, definition)
+        for name in set(self.files) - seen:
+            del self.files[name]
+            logger.info("preset {} removed".format(name))
+            changed[name] = self.replace(name, self.builtins.get(name))
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+
+    def replace(self, name, definition):
+        """Swap in a new definition, or drop the preset for None, returning
+        the program created from the old one if there was one."""
+        with self.lock:
+            if definition is None:
+                self.definitions.pop(name, None)
+            else:
+                self.definitions[name] = definition
+            return self.instances.pop(name, None)
+
+
+class PresetWatcher(threading.Thread):
+    """Polls a PresetLibrary's files for changes every interval seconds."""
+    def __init__(self, library, interval=2):
+        super().__init__()
+        self.library = library
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.library.refresh()
+            except Exception:
+                logger.exception("Exception reloading presets")
+
+
+presets = PresetLibrary(frame_main, {
+    "rainbow": PresetDefinition(Rainbow),
+    "zap": PresetDefinition(Zap),
+    "test": PresetDefinition(TestChecker),
+    "chase": PresetDefinition(Chase),
+    "projector": PresetDefinition(ProjectorBow),
+    "emergency": PresetDefinition(Emergency),
+    "emergency2": PresetDefinition(Emergency2),
+    "bercostat": PresetDefinition(Bercostat),
+    "bercostatbow": PresetDefinition(BercostatBow),
+    "dimrainbow": PresetDefinition(DimRainbow),
+    "pixelpicker": PresetDefinition(PixelPicker),
+}, preset_path)
+
+
+class AsyncMainLed(MainLedThread):
+    """MainLedThread's jobs and stepping, driven by an event loop coroutine."""
+    def __init__(self, loop, cache=None, isolate=False):
+        super().__init__(cache, isolate)
+        self.event_loop = loop
+        self.wakeup = asyncio.Event()
+
+    def queue_job(self, job, *args):
+        super().queue_job(job, *args)
+        self.event_loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def animate(self):
+        while True:
+            try:
+                self.run_pending()
+                timeout = self.timeout()
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    else:
+                        self.wakeup.clear()
+                        continue
+                self.step()
+            except Exception as e:
+                logger.exception("Exception in animation: %s", e)
+                self.program = self.steps = None
+                await asyncio.sleep(1)
+
+
+class UdpFrameProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams to a ServerProgram's decoder on the event loop.
+
+    Datagrams handled before the loop next gets round to flush() share a
+    single show().
+    """
+    def __init__(self, program):
+        self.program = program
+        self.render = False
+        self.scheduled = False
+
+    def datagram_received(self, data, address):
+        self.render = self.program.decode(memoryview(data)) or self.render
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if self.render:
+            self.render = False
+            self.program.show()
+
+
+class AsyncMqtt:
+    """Runs a paho client's network traffic on an event loop via its socket hooks."""
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        if self.misc is None:
+            self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        while True:
+            if self.client.loop_misc() != mqtt_client.MQTT_ERR_SUCCESS:
+                logger.warning("mqtt disconnected, reconnecting")
+                try:
+                    self.client.reconnect()
+                except OSError:
+                    logger.exception("mqtt reconnect failed")
+            await asyncio.sleep(1)
+
+
+class AsyncRuntime:
+    """Runs the whole daemon on one asyncio event loop.
+
+    The UDP servers are datagram protocols, MQTT traffic is handled through
+    the client's socket hooks, programs are stepped by a coroutine and the
+    renderer is a coroutine woken by notify_render(). Only the blocking
+    strip write runs in an executor thread.
+    """
+    def __init__(self, renderer, servers, cache=None, stats_interval=0, isolate=False):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.renderer = renderer
+        self.servers = servers
+        self.worker = AsyncMainLed(self.loop, cache, isolate)
+        self.stats_interval = stats_interval
+        self.dirty = asyncio.Event()
+        render_listeners.append(lambda: self.loop.call_soon_threadsafe(self.dirty.set))
+
+    async def render(self):
+        renderer = self.renderer
+        await self.loop.run_in_executor(None, renderer.backend.begin)
+        while True:
+            now = time.monotonic()
+            now -= now % Compositor.fade_interval
+            started = time.perf_counter()
+            with render_condition:
+                rendered = renderer.render(now)
+            if rendered:
+                await self.loop.run_in_executor(None, renderer.backend.show)
+                renderer.shown_frame(started)
+                continue
+            try:
+                await asyncio.wait_for(self.dirty.wait(), renderer.next_change(now))
+            except asyncio.TimeoutError:
+                pass
+            self.dirty.clear()
+
+    async def publish_stats(self, client):
+        publisher = StatsPublisher(client, self.stats_interval)
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            publisher.publish()
+
+    async def serve(self, *tasks):
+        """Serve the UDP servers, render and animate, alongside any other tasks."""
+        for program in self.servers:
+            await self.loop.create_datagram_endpoint(
+                lambda program=program: UdpFrameProtocol(program),
+                sock=program.open_socket())
+        await asyncio.gather(self.render(), self.worker.animate(), *tasks)
+
+    async def main(self, client):
+        AsyncMqtt(self.loop, client)
+        client.connect("mqtt")
+        tasks = []
+        if self.stats_interval > 0:
+            tasks.append(self.publish_stats(client))
+        await self.serve(*tasks)
+
+    def run(self, client):
+        self.loop.run_until_complete(self.main(client))
+
+
+def benchmark(pixel_counts=(776, 5000, 50000), frame_count=200):
+    """Run every preset headless and report how long its frames take.
+
+    Each preset is stepped frame_count times without sleeping into a fresh
+    frame of each size, rendered through a NullBackend. Reports wall time
+    per frame, the peak memory allocated while drawing each frame and the
+    frame rate that would allow.
+    """
+    print("{:>8} {:<14} {:>9} {:>14} {:>10}".format(
+        "pixels", "preset", "ms/frame", "alloc KiB/frm", "max fps"))
+    for count in pixel_counts:
+        for name, preset in presets.items():
+            frame = Frame(count)
+            program = type(preset)(frame, *preset.args, zone=preset.zone, values=preset.values,
+                                   **preset.kwargs)
+            renderer = Renderer(NullBackend(count))
+            renderer.frames = [frame]
+
+            def step():
+                next(steps)
+                with render_condition:
+                    rendered = renderer.render(time.monotonic())
+                if rendered:
+                    renderer.backend.show()
+
+            steps = program.steps()
+            step()
+            started = time.perf_counter()
+            for i in range(frame_count):
+                step()
+            elapsed = (time.perf_counter() - started) / frame_count
+
+            allocated = 0
+            tracemalloc.start()
+            for i in range(min(frame_count, 20)):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                step()
+                allocated += tracemalloc.get_traced_memory()[1] - before
+            tracemalloc.stop()
+            allocated /= min(frame_count, 20)
+
+            print("{:>8} {:<14} {:>9.3f} {:>14.1f} {:>10.0f}".format(
+                count, name, elapsed * 1000, allocated / 1024, 1 / elapsed))
+
+    if telemetry.enabled:
+        samples = 100000
+        started = time.perf_counter()
+        for i in range(samples):
+            telemetry.record('benchmark', 1.0)
+        elapsed = time.perf_counter() - started
+        telemetry.snapshot(1)
+        print("telemetry overhead {:.0f}ns per sample".format(elapsed / samples * 1e9))
+
+
+class MockStrip:
+    """Stands in for rpi_ws281x's Adafruit_NeoPixel in benchmarks."""
+    def __init__(self, pixels):
+        self._led_data = [0] * pixels
+
+    def setPixelColor(self, pixel, colour):
+        self._led_data[pixel] = colour
+
+    def show(self):
+        pass
+
+
+def benchmark_push(pixel_counts=(776, 5000, 50000), frame_count=50):
+    """Time pushing a whole new frame and rendering it to a mock strip.
+
+    Compares the Frame and Renderer against the original path, where a
+    frame was a list set pixel by pixel, copied on show() and written to
+    the strip with a setPixelColor() per pixel.
+    """
+    print("{:>8} {:>12} {:>12} {:>9}".format("pixels", "list ms", "numpy ms", "speedup"))
+    for count in pixel_counts:
+        ramp = np.arange(count, dtype=np.uint32)
+        colours = [ramp, ramp[::-1].copy()]
+
+        strip = MockStrip(count)
+        data = [0] * count
+        lists = [colour.tolist() for colour in colours]
+        started = time.perf_counter()
+        for i in range(frame_count):
+            for pixel, colour in enumerate(lists[i % 2]):
+                data[pixel] = colour
+            shown = data.copy()
+            for pixel in range(count):
+                strip.setPixelColor(pixel, shown[pixel])
+            strip.show()
+        list_time = (time.perf_counter() - started) / frame_count
+
+        frame = Frame(count)
+        backend = NeoPixelBackend(count)
+        backend.strip = MockStrip(count)
+        renderer = Renderer(backend)
+        renderer.frames = [frame]
+        started = time.perf_counter()
+        for i in range(frame_count):
+            frame.set_array(colours[i % 2])
+            frame.show()
+            with render_condition:
+                renderer.render(time.monotonic())
+            backend.show()
+        numpy_time = (time.perf_counter() - started) / frame_count
+
+        print("{:>8} {:>12.3f} {:>12.3f} {:>8.1f}x".format(
+            count, list_time * 1000, numpy_time * 1000, list_time / numpy_time))
+
+
+def benchmark_composite(pixel_counts=(776,), frame_count=200, budget=0.016):
+    """Time compositing three changing layers against a 60fps frame budget.
+
+    An opaque main layer sits under a half opacity 'add' layer and a 'max'
+    layer that is fading out, all redrawn in full every frame, and the
+    result is rendered through a NullBackend.
+    """
+    print("{:>8} {:>9} {:>9} {:>8}".format("pixels", "mean ms", "worst ms", "budget"))
+    for count in pixel_counts:
+        main = Frame(count, timeout=5)
+        overlay = Frame(count, timeout=5, priority=1, opacity=0.5, blend='add')
+        fading = Frame(count, timeout=0, priority=2, blend='max', fade=3600)
+        renderer = Renderer(NullBackend(count))
+        renderer.frames = [fading, overlay, main]
+        rainbow = RainbowEngine(count)
+        times = []
+        for i in range(frame_count):
+            started = time.perf_counter()
+            main.set_array(rainbow.row(i % 360))
+            overlay.set_array(rainbow.row((i * 7) % 360, multiplier=5))
+            fading.set_array(rainbow.row((i * 3) % 360, multiplier=1, divisor=4))
+            for frame in renderer.frames:
+                frame.show()
+            with render_condition:
+                renderer.render(time.monotonic())
+            renderer.backend.show()
+            times.append(time.perf_counter() - started)
+        mean = sum(times) / len(times)
+        print("{:>8} {:>9.3f} {:>9.3f} {:>8}".format(
+            count, mean * 1000, max(times) * 1000,
+            "ok" if max(times) <= budget else "over"))
+
+
+def benchmark_idle(seconds=5, pixel_count=pixels):
+    """Report the CPU used while the display is static.
+
+    A StaticColour keeps re-showing the same frame under a layer that was
+    shown once and then times out, rendered to a NullBackend, which is the
+    daemon's usual state with nothing happening.
+    """
+    static = Frame(pixel_count, timeout=5)
+    passing = Frame(pixel_count, timeout=1, priority=1, fade=0.5)
+    renderer = Renderer(NullBackend(pixel_count))
+    renderer.frames = [passing, static]
+    renderer.daemon = True
+    renderer.start()
+    runner = ProgramRunnerThread()
+    runner.program = StaticColour(static, rgb_to_24bit(255, 128, 0))
+    runner.daemon = True
+    runner.start()
+    passing.set_all(rgb_to_24bit(0, 0, 255))
+    passing.show()
+    # let the passing layer time out and fade before measuring
+    time.sleep(passing.timeout + passing.fade + 0.5)
+    rendered = renderer.frames_rendered
+    cpu = CpuUsage()
+    time.sleep(seconds)
+    print("idle CPU {:.1f}% over {}s, {} frames rendered, {} repeated shows skipped".format(
+        cpu(), seconds, renderer.frames_rendered - rendered, static.frames_skipped))
+
+
+def benchmark_outputs(pixel_count, channel_counts, frame_count=20):
+    """Report the refresh rate of pixel_count pixels split across each number
+    of simulated WS281x outputs."""
+    print("{:>8} {:>9} {:>9} {:>10}".format("pixels", "outputs", "ms/frame", "max fps"))
+    colours = np.zeros(pixel_count, dtype=np.uint32)
+    for channels in channel_counts:
+        sizes = [pixel_count // channels + (i < pixel_count % channels) for i in range(channels)]
+        backend = SplitBackend.chain([SimulatedStripBackend(size) for size in sizes])
+        backend.begin()
+        started = time.perf_counter()
+        for i in range(frame_count):
+            backend.write(colours)
+            backend.show()
+        elapsed = (time.perf_counter() - started) / frame_count
+        print("{:>8} {:>9} {:>9.3f} {:>10.0f}".format(
+            pixel_count, channels, elapsed * 1000, 1 / elapsed))
+
+
+def benchmark_ingest(pixel_count=pixels, seconds=2, ports=(2812, 2813)):
+    """Send full 0x03 frames to a ServerProgram on each port at several rates
+    and report the frames sent, received and shown per second and the
+    packets lost on the way."""
+    print("{:>6} {:>8} {:>9} {:>9} {:>9} {:>7}".format(
+        "port", "target", "sent/s", "recv/s", "shown/s", "loss %"))
+    packets = []
+    for value in (0x20, 0x40):
+        packet = bytearray([0x03]) + bytes([value]) * (pixel_count * 3)
+        packets.append(bytes(packet))
+    for port in ports:
+        for rate in (100, 1000, None):
+            frame = Frame(pixel_count)
+            receiver = ProgramRunnerThread()
+            receiver.program = ServerProgram(frame)
+            receiver.program.port = port
+            receiver.daemon = True
+            receiver.start()
+            time.sleep(0.2)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            clock = FrameClock()
+            sent = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                sock.sendto(packets[sent % 2], ("127.0.0.1", port))
+                sent += 1
+                if rate is not None:
+                    time.sleep(max(0, clock.next_deadline(1 / rate) - time.monotonic()))
+            elapsed = time.perf_counter() - started
+            time.sleep(0.2)
+            received = receiver.program.packets_received
+            shown = frame.generation + frame.frames_skipped
+            receiver.stop()
+            sock.close()
+            print("{:>6} {:>8} {:>9.0f} {:>9.0f} {:>9.0f} {:>7.2f}".format(
+                port, rate or "max", sent / elapsed, received / elapsed, shown / elapsed,
+                100 * (sent - received) / sent))
+
+
+class ProbeBackend(NullBackend):
+    """Notes when each value of the first pixel reaches the strip."""
+    def __init__(self, pixels):
+        super().__init__(pixels)
+        self.first = None
+        self.shown = []
+
+    def write(self, colours, start=0):
+        if start == 0 and len(colours):
+            self.first = int(colours[0])
+
+    def show(self):
+        super().show()
+        self.shown.append((time.perf_counter(), self.first))
+
+
+def runtime_trial(use_asyncio, pixel_count, port, conn):
+    """The daemon's side of benchmark_runtimes(), run in a process of its own.
+
+    A ServerProgram on port draws the network frame over a Rainbow in the
+    main frame, rendered to a ProbeBackend by the threaded or the asyncio
+    runtime. Between 'start' and 'stop' from conn it measures its CPU use,
+    then sends that and the probe's shows back.
+    """
+    # asyncio's own debug logging included
+    logging.getLogger().setLevel(logging.WARNING)
+    net = Frame(pixel_count, timeout=1, priority=2)
+    main = Frame(pixel_count, timeout=5)
+    renderer = Renderer(ProbeBackend(pixel_count))
+    renderer.frames = [net, main]
+    server = ServerProgram(net)
+    server.port = port
+    if use_asyncio:
+        runtime = AsyncRuntime(renderer, [server])
+        worker = runtime.worker
+        thread = threading.Thread(target=runtime.loop.run_until_complete,
+                                  args=(runtime.serve(),))
+    else:
+        renderer.daemon = True
+        renderer.start()
+        thread = ProgramRunnerThread()
+        thread.program = server
+        worker = MainLedThread()
+        worker.daemon = True
+        worker.start()
+    thread.daemon = True
+    thread.start()
+    worker.post(Rainbow(main))
+    time.sleep(0.5)
+    conn.send('ready')
+    conn.recv()
+    cpu = CpuUsage()
+    shown = len(renderer.backend.shown)
+    conn.recv()
+    conn.send((cpu(), renderer.backend.shown[shown:]))
+
+
+def benchmark_runtimes(pixel_count=pixels, seconds=5, rate=40, port=2899):
+    """Compare the threaded and asyncio runtimes under the same load.
+
+    Each runtime runs in a fresh process, see runtime_trial(), while full
+    0x03 frames are sent to it at rate per second, each with its number in
+    the first pixel. Reports the process's CPU use and the input to photon
+    latency, from a frame being sent to the backend show() that puts it on
+    the strip, of the frames that made it.
+    """
+    print("{:>9} {:>6} {:>8} {:>9} {:>9} {:>9}".format(
+        "runtime", "cpu %", "shown/s", "mean ms", "p95 ms", "max ms"))
+    context = multiprocessing.get_context('spawn')
+    colours = np.zeros((pixel_count, 3), dtype=np.uint8)
+    colours[1:] = 0x20
+    for use_asyncio in (False, True):
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=runtime_trial, daemon=True,
+                                  args=(use_asyncio, pixel_count, port, child_conn))
+        process.start()
+        conn.recv()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        clock = FrameClock()
+        sent = {}
+
+        def send(count):
+            for i in range(count):
+                number = len(sent) + 1
+                # packed back into the 24 bit colour g << 16 | r << 8 | b
+                colours[0] = (number >> 8) & 0xff, (number >> 16) & 0xff, number & 0xff
+                sent[number] = time.perf_counter()
+                sock.sendto(b'\x03' + colours.tobytes(), ("127.0.0.1", port))
+                time.sleep(max(0, clock.next_deadline(1 / rate) - time.monotonic()))
+
+        # settle in before measuring
+        send(rate)
+        conn.send('start')
+        first = len(sent) + 1
+        send(int(seconds * rate))
+        conn.send('stop')
+        cpu, shown = conn.recv()
+        process.terminate()
+        process.join()
+        sock.close()
+
+        latencies = {}
+        for at, number in shown:
+            if number in sent and number >= first and number not in latencies:
+                latencies[number] = (at - sent[number]) * 1000
+        latencies = np.array(sorted(latencies.values()))
+        if not len(latencies):
+            print("{:>9} {:>6.1f} no frames shown".format(
+                "asyncio" if use_asyncio else "threaded", cpu))
+            continue
+        print("{:>9} {:>6.1f} {:>8.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            "asyncio" if use_asyncio else "threaded", cpu, len(latencies) / seconds,
+            latencies.mean(), np.percentile(latencies, 95), latencies.max()))
+
+
+class BusyProgram(LedProgram):
+    """Spends each frame in pure Python arithmetic, holding the GIL, for
+    benchmark_jitter(). Module level so isolated children can import it."""
+    def setup(self, work=60):
+        self.work = work
+
+    def loop(self):
+        x = 0
+        for p in range(self.pixel_count * self.work):
+            x = (x + p * 7) % 255
+        self.set_all(rgb_to_24bit(x, x, x))
+        self.show()
+        yield 0
+
+
+class TimedServerProgram(ServerProgram):
+    """A ServerProgram noting when it shows each value of the first pixel."""
+    def setup(self):
+        self.shown = []
+
+    def show(self):
+        self.shown.append((time.perf_counter(), int(self.frame.data[0])))
+        super().show()
+
+
+def benchmark_jitter(pixel_count=pixels, seconds=3, rate=100, port=2899):
+    """Report how much a CPU bound program delays a UDP server, with and
+    without --isolate.
+
+    A BusyProgram runs on the animation worker while 0x01 packets, each
+    numbered in its colour, are sent to a server thread at rate per second.
+    Reports the latency from each packet being sent to its frame being
+    shown, the spread of the intervals between those shows, and the packets
+    never shown because they were drained in a burst with a later one.
+    """
+    print("{:>9} {:>9} {:>9} {:>9} {:>12} {:>7}".format(
+        "mode", "mean ms", "p99 ms", "max ms", "interval sd", "unshown"))
+    for isolate in (False, True):
+        server = TimedServerProgram(Frame(pixel_count))
+        server.port = port
+        server.prepare()
+        receiver = ProgramRunnerThread()
+        receiver.program = server
+        receiver.daemon = True
+        receiver.start()
+        frame = Frame(pixel_count)
+        worker = MainLedThread(isolate=isolate)
+        worker.daemon = True
+        worker.start()
+        worker.post(BusyProgram(frame))
+        # long enough for an isolated child to have started
+        time.sleep(2 if isolate else 0.5)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        clock = FrameClock()
+        sent = {}
+        for number in range(1, int(seconds * rate) + 1):
+            sent[number] = time.perf_counter()
+            r, g, b = (number >> 8) & 0xff, (number >> 16) & 0xff, number & 0xff
+            sock.sendto(bytes([0x01, r, g, b]), ("127.0.0.1", port))
+            time.sleep(max(0, clock.next_deadline(1 / rate) - time.monotonic()))
+        time.sleep(0.2)
+        # a program that finishes at once leaves the worker idle
+        worker.post(LedProgram(frame))
+        receiver.stop()
+        sock.close()
+
+        shown = {}
+        for at, number in server.shown:
+            if number in sent and number not in shown:
+                shown[number] = at
+        latencies = np.array([(at - sent[number]) * 1000 for number, at in shown.items()])
+        intervals = np.diff(sorted(shown.values())) * 1000
+        print("{:>9} {:>9.2f} {:>9.2f} {:>9.2f} {:>12.2f} {:>7}".format(
+            "isolated" if isolate else "threaded", latencies.mean(),
+            np.percentile(latencies, 99), latencies.max(), intervals.std(),
+            len(sent) - len(shown)))
+
+
+def benchmark_udp(pixel_count, seconds=2, port=2899):
+    """Stream frames to a ServerProgram on localhost through a UdpBackend in
+    each mode and report the frame rate achieved at each end and the bytes
+    sent."""
+    print("{:>8} {:<10} {:>10} {:>10} {:>10} {:>12}".format(
+        "pixels", "mode", "sent fps", "shown fps", "dropped", "KiB/s"))
+    modes = [('frame', False, False), ('delta', False, True),
+             ('fragments', True, False), ('frag+delta', True, True)]
+    colours = np.arange(pixel_count, dtype=np.uint32)
+    for name, fragments, delta in modes:
+        frame = Frame(pixel_count)
+        receiver = ProgramRunnerThread()
+        receiver.program = ServerProgram(frame)
+        receiver.program.port = port
+        receiver.daemon = True
+        receiver.start()
+        time.sleep(0.2)
+        backend = UdpBackend(pixel_count, [("127.0.0.1", port)], fragments, delta)
+        backend.begin()
+        sent = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            # a tenth of the strip changes each frame
+            colours[:pixel_count // 10] += 1
+            backend.write(colours[:pixel_count // 10])
+            backend.show()
+            sent += 1
+            time.sleep(0)
+        elapsed = time.perf_counter() - started
+        time.sleep(0.1)
+        shown = frame.generation + frame.frames_skipped
+        receiver.stop()
+        print("{:>8} {:<10} {:>10.0f} {:>10.0f} {:>10} {:>12.0f}".format(
+            pixel_count, name, sent / elapsed, shown / elapsed, backend.packets_dropped,
+            backend.bytes_sent / elapsed / 1024))
+        backend.sock.close()
+        port += 1
+
+
+def benchmark_dmx(pixel_count, frame_count=200, port=2899):
+    """Send frames as synthetic universes plus a sync packet to an E1.31 and
+    an Art-Net receiver on localhost, waiting for each to be shown, and
+    report the frame rate and send to show latency."""
+    print("{:>8} {:<8} {:>9} {:>8} {:>12} {:>12}".format(
+        "pixels", "protocol", "universes", "fps", "latency ms", "max ms"))
+    for protocol in (E131Program, ArtNetProgram):
+        frame = Frame(pixel_count)
+        receiver = ProgramRunnerThread()
+        receiver.program = protocol(frame)
+        receiver.program.port = port
+        receiver.daemon = True
+        receiver.start()
+        time.sleep(0.2)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        universes = receiver.program.universes()
+        channels = np.zeros(len(universes) * DmxProgram.pixels_per_universe * 3, dtype=np.uint8)
+        latencies = []
+        started = time.perf_counter()
+        for i in range(frame_count):
+            channels[:] = i % 255 + 1
+            sent = time.perf_counter()
+            for n, universe in enumerate(universes):
+                data = channels[n * 510:(n + 1) * 510].tobytes()
+                if protocol is E131Program:
+                    packet = E131Program.packet(universe, i & 0xff, data, sync_address=1)
+                else:
+                    packet = ArtNetProgram.packet(universe, i % 255 + 1, data)
+                sock.sendto(packet, ("127.0.0.1", port))
+            if protocol is E131Program:
+                sock.sendto(E131Program.sync_packet(i & 0xff, 1), ("127.0.0.1", port))
+            else:
+                sock.sendto(ArtNetProgram.sync_packet(), ("127.0.0.1", port))
+            if frame.frame_ready.wait(1):
+                latencies.append((time.perf_counter() - sent) * 1000)
+            frame.frame_ready.clear()
+        elapsed = time.perf_counter() - started
+        receiver.stop()
+        sock.close()
+        print("{:>8} {:<8} {:>9} {:>8.0f} {:>12.3f} {:>12.3f}".format(
+            pixel_count, protocol.__name__[:-7], len(universes), len(latencies) / elapsed,
+            np.mean(latencies) if latencies else float('nan'), max(latencies, default=0)))
+        port += 1
+
+
+def parse_endpoint(spec):
+    """Parse a host[:port] for a remote controller, defaulting to ServerProgram's port."""
+    host, _, port = spec.partition(':')
+    return host, int(port or ServerProgram.port)
+
+
+def parse_strip(spec):
+    """Parse a --strip of pixels[:pin[:dma[:channel]]] into a NeoPixelBackend."""
+    values = [int(value) for value in spec.split(':')]
+    if not 1 <= len(values) <= 4:
+        raise argparse.ArgumentTypeError(
+            "expected pixels[:pin[:dma[:channel]]], got {}".format(spec))
+    count, pin, dma, channel = values + [18, 5, 0][len(values) - 1:]
+    return NeoPixelBackend(count, pin, dma=dma, channel=channel)
 
 
 def get_args():
     ap = argparse.ArgumentParser()
     ap.add_argument('-D', '--debug', action='store_true', default=False,
                     help='Enable debug logging')
+    ap.add_argument('-g', '--gamma', type=float, default=1.0,
+                    help='Gamma curve applied to every colour channel')
+    ap.add_argument('--stats-interval', type=float, default=10,
+                    help='Seconds between performance stats published over MQTT, 0 to disable')
+    ap.add_argument('--cache-size', type=int, default=0,
+                    help='Megabytes of recorded animations to keep, 0 (the default) to '
+                    'run every program live')
+    ap.add_argument('--asyncio', action='store_true', default=False,
+                    help='Run everything on one asyncio event loop instead of threads')
+    ap.add_argument('--isolate', action='store_true', default=False,
+                    help='Run each program in a process of its own, so a slow one '
+                    'can\'t starve the UDP servers or the renderer')
+    ap.add_argument('--strip', action='append', type=parse_strip, dest='strips',
+                    metavar='PIXELS[:PIN[:DMA[:CHANNEL]]]',
+                    help='A WS281x output, repeat for more; the frame is split '
+                    'across them end to end in order (default {}:18:5:0)'.format(pixels))
+    ap.add_argument('--udp-output', action='append', type=parse_endpoint,
+                    dest='udp_outputs', metavar='HOST[:PORT]',
+                    help='Also stream the whole frame to a remote controller, repeat for more')
+    ap.add_argument('--udp-fragments', action='store_true', default=False,
+                    help='Stream as 0x06 fragments, shown only once a frame is complete')
+    ap.add_argument('--udp-delta', action='store_true', default=False,
+                    help='Stream only the packets covering changed pixels, '
+                    'with a full frame every second')
+    ap.add_argument('--benchmark-ingest', action='store_true', default=False,
+                    help='Send full frames to local servers on ports 2812 and 2813 and '
+                    'report the frame rate and packet loss, then exit')
+    ap.add_argument('--benchmark-runtimes', action='store_true', default=False,
+                    help='Compare the CPU use and input to photon latency of the threaded '
+                    'and asyncio runtimes under the same UDP stream and exit')
+    ap.add_argument('--benchmark-jitter', action='store_true', default=False,
+                    help='Measure how much a CPU bound program delays a UDP server, '
+                    'with and without --isolate, and exit')
+    ap.add_argument('--benchmark-udp', action='store_true', default=False,
+                    help='Stream frames to a local receiver through each UDP output mode and exit')
+    ap.add_argument('--audio', default=None, metavar='SOURCE',
+                    help='Draw the music frame from PCM audio (16 bit mono 44.1kHz) read '
+                    'from a file or pipe, or udp:PORT, instead of taking it over UDP')
+    ap.add_argument('--e131', type=int, default=None, metavar='UNIVERSE',
+                    help='Receive E1.31 (sACN) from this universe onwards, in a layer '
+                    'beside the network frame')
+    ap.add_argument('--artnet', type=int, default=None, metavar='UNIVERSE',
+                    help='Receive Art-Net from this universe onwards, in a layer '
+                    'beside the network frame')
+    ap.add_argument('--benchmark-dmx', action='store_true', default=False,
+                    help='Stream synthetic E1.31 and Art-Net universes to local receivers and exit')
+    ap.add_argument('--benchmark-push', action='store_true', default=False,
+                    help='Compare pushing and rendering frames against the original '
+                    'list based path and exit')
+    ap.add_argument('--benchmark-composite', action='store_true', default=False,
+                    help='Time compositing three layers against a 16ms frame budget and exit')
+    ap.add_argument('--benchmark-idle', action='store_true', default=False,
+                    help='Measure the CPU used while the display is static and exit')
+    ap.add_argument('--benchmark-outputs', default=None, metavar='COUNTS',
+                    help='Time a frame split across each of these numbers of '
+                    'simulated strips, e.g. 1,2,4, and exit')
+    ap.add_argument('--benchmark', action='store_true', default=False,
+                    help='Time every preset without hardware, then exit')
+    ap.add_argument('--benchmark-pixels', default='776,5000,50000',
+                    help='Comma separated pixel counts to benchmark')
+    ap.add_argument('--benchmark-frames', type=int, default=200,
+                    help='Frames to time per preset and pixel count')
     return ap.parse_args()
 
 
@@ -646,33 +3602,161 @@ def main():
     if args.debug:
         logger.setLevel(logging.DEBUG)
 
-    rendererthread = Renderer()
+    set_brightness(brightness_pct, args.gamma)
+    if os.path.exists(zone_path):
+        load_zones(zone_path)
+    presets.refresh()
+
+    telemetry.enabled = args.stats_interval > 0
+
+    if args.benchmark:
+        logger.setLevel(logging.WARNING)
+        benchmark([int(count) for count in args.benchmark_pixels.split(',')],
+                  args.benchmark_frames)
+        return
+
+    if args.benchmark_push:
+        logger.setLevel(logging.WARNING)
+        benchmark_push([int(count) for count in args.benchmark_pixels.split(',')],
+                       min(args.benchmark_frames, 50))
+        return
+
+    if args.benchmark_composite:
+        logger.setLevel(logging.WARNING)
+        benchmark_composite([int(count) for count in args.benchmark_pixels.split(',')],
+                            args.benchmark_frames)
+        return
+
+    if args.benchmark_idle:
+        logger.setLevel(logging.WARNING)
+        benchmark_idle()
+        return
+
+    if args.benchmark_outputs:
+        logger.setLevel(logging.WARNING)
+        for count in args.benchmark_pixels.split(','):
+            benchmark_outputs(int(count), [int(channels) for channels in
+                                           args.benchmark_outputs.split(',')])
+        return
+
+    if args.benchmark_dmx:
+        logger.setLevel(logging.WARNING)
+        for count in args.benchmark_pixels.split(','):
+            benchmark_dmx(int(count))
+        return
+
+    if args.benchmark_ingest:
+        logger.setLevel(logging.WARNING)
+        benchmark_ingest()
+        return
+
+    if args.benchmark_runtimes:
+        logger.setLevel(logging.WARNING)
+        benchmark_runtimes()
+        return
+
+    if args.benchmark_jitter:
+        logger.setLevel(logging.WARNING)
+        benchmark_jitter()
+        return
+
+    if args.benchmark_udp:
+        logger.setLevel(logging.WARNING)
+        for count in args.benchmark_pixels.split(','):
+            benchmark_udp(int(count))
+        return
+
+    strips = args.strips or [NeoPixelBackend(pixels)]
+    if args.udp_outputs:
+        split = SplitBackend.chain(strips)
+        remote = UdpBackend(split.pixels, args.udp_outputs, args.udp_fragments, args.udp_delta)
+        backend = SplitBackend(split.segments + [(remote, 0, split.pixels, 0, False)])
+    elif len(strips) == 1:
+        backend = strips[0]
+    else:
+        backend = SplitBackend.chain(strips)
+    if backend.pixels != frame_main.pixels:
+        logger.info("sizing frames to the {} pixels of the outputs".format(backend.pixels))
+        for frame in (frame_net, frame_music, frame_main, frame_fallback):
+            frame.resize(backend.pixels)
+    rendererthread = Renderer(backend)
     rendererthread.frames = [frame_net, frame_music, frame_main]
+
+    net = ServerProgram(frame_net)
+    servers = [net]
+    programs = []
+    if args.audio:
+        programs.append(AudioReactive(frame_music, args.audio))
+    else:
+        music = ServerProgram(frame_music)
+        music.port = 2813
+        servers.append(music)
+    # each receiver thread draws a layer of its own, as threads can't share a Frame
+    if args.e131 is not None:
+        e131 = E131Program(Frame(backend.pixels, timeout=1, priority=2, fade=0.5))
+        e131.first_universe = args.e131
+        servers.append(e131)
+        rendererthread.frames.append(e131.frame)
+    if args.artnet is not None:
+        artnet = ArtNetProgram(Frame(backend.pixels, timeout=1, priority=2, fade=0.5))
+        artnet.first_universe = args.artnet
+        servers.append(artnet)
+        rendererthread.frames.append(artnet.frame)
+
+    cache = None
+    if args.cache_size > 0:
+        try:
+            cache = AnimationCache(os.path.join(preset_path, "cache"),
+                                   args.cache_size * 1024 * 1024)
+        except OSError:
+            logger.exception("animation cache disabled")
+
+    watcher = PresetWatcher(presets)
+    watcher.daemon = True
+    watcher.start()
+    # only once the picker has been used
+    telemetry.gauge('queue.picker', lambda: presets.instances["pixelpicker"].action_queue.qsize()
+                    if "pixelpicker" in presets.instances else None)
+
+    m = mqtt_client.Client()
+    m.on_connect = on_connect
+
+    for program in programs:
+        thread = ProgramRunnerThread()
+        thread.program = program
+        thread.daemon = True
+        thread.start()
+
+    if args.asyncio:
+        runtime = AsyncRuntime(rendererthread, servers, cache, args.stats_interval,
+                               args.isolate)
+        runtime.worker.post(presets["rainbow"])
+        m.on_message = MessageHandler(runtime.worker).on_message
+        runtime.run(m)
+        return
+
     rendererthread.daemon = True
     rendererthread.start()
 
-    netthread = ProgramRunnerThread()
-    netthread.program = ServerProgram(frame_net)
-    netthread.daemon = True
-    netthread.start()
-
-    musicthread = ProgramRunnerThread()
-    musicthread.program = ServerProgram(frame_music)
-    musicthread.program.port = 2813
-    musicthread.daemon = True
-    musicthread.start()
+    for program in servers:
+        thread = ProgramRunnerThread()
+        thread.program = program
+        thread.daemon = True
+        thread.start()
 
-    mainledthread = MainLedThread()
+    mainledthread = MainLedThread(cache, args.isolate)
     mainledthread.post(presets["rainbow"])
     mainledthread.daemon = True
     mainledthread.start()
 
-    message_handler = MessageHandler(mainledthread)
-
-    m = mqtt_client.Client()
-    m.on_connect = on_connect
-    m.on_message = message_handler.on_message
+    m.on_message = MessageHandler(mainledthread).on_message
     m.connect("mqtt")
+
+    if telemetry.enabled:
+        publisher = StatsPublisher(m, args.stats_interval)
+        publisher.daemon = True
+        publisher.start()
+
     m.loop_forever()
 
 
@@ -27,6 +27,7 @@ package_data = {
 requires = [
     'webcolors',
     'paho-mqtt',
+    'numpy',
 ]
 
 classifiers = [
@@ -0,0 +1,45 @@
+import numpy as np
+
+import leds
+
+
+def fragment(sequence, index, count, offset, colours):
+    return (leds.FrameAssembler.header.pack(0x06, sequence, index, count, offset) +
+            bytes(colours))
+
+
+def test_frame_completes_once_every_fragment_arrives():
+    assembler = leds.FrameAssembler(4)
+    assert assembler.add(fragment(1, 1, 2, 2, [0, 0, 3, 0, 0, 4]), now=0) is None
+    frame = assembler.add(fragment(1, 0, 2, 0, [0, 0, 1, 0, 0, 2]), now=0)
+    np.testing.assert_array_equal(frame, [1, 2, 3, 4])
+    assert assembler.frames_completed == 1
+
+
+def test_out_of_range_indices_do_not_complete_a_frame():
+    assembler = leds.FrameAssembler(9)
+    assert assembler.add(fragment(1, 0, 3, 0, [1] * 9), now=0) is None
+    assert assembler.add(fragment(1, 7, 3, 3, [2] * 9), now=0) is None
+    assert assembler.add(fragment(1, 9, 3, 6, [3] * 9), now=0) is None
+    assert assembler.frames_completed == 0
+    assert assembler.fragments_invalid == 2
+
+
+def test_mismatched_count_is_ignored():
+    assembler = leds.FrameAssembler(6)
+    assert assembler.add(fragment(1, 0, 3, 0, [1] * 6), now=0) is None
+    # claims a two fragment frame, which would complete it with fragment 2 missing
+    assert assembler.add(fragment(1, 1, 2, 2, [2] * 6), now=0) is None
+    assert assembler.frames_completed == 0
+    assert assembler.fragments_invalid == 1
+    assert assembler.add(fragment(1, 1, 3, 2, [2] * 3), now=0) is None
+    assert assembler.add(fragment(1, 2, 3, 4, [3] * 6), now=0) is not None
+
+
+def test_late_fragments_are_ignored():
+    assembler = leds.FrameAssembler(2)
+    assembler.add(fragment(5, 0, 2, 0, [1] * 3), now=0)
+    assembler.add(fragment(6, 0, 1, 0, [2] * 6), now=0)
+    assert assembler.add(fragment(5, 1, 2, 1, [1] * 3), now=0) is None
+    assert assembler.frames_late == 1
+    assert assembler.frames_dropped == 1
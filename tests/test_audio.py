@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import leds
+
+
+def tone(frequency, count, sample_rate=44100):
+    t = np.arange(count) / sample_rate
+    return (np.sin(2 * np.pi * frequency * t) * 16000).astype('<i2')
+
+
+@pytest.mark.parametrize('bands', [4, 16, 64])
+def test_every_band_has_bins_of_its_own(bands):
+    edges = leds.AudioAnalyser('unused', bands=bands).edges
+    assert len(edges) == bands + 1
+    assert (np.diff(edges) > 0).all()
+
+
+@pytest.mark.parametrize('frequency', [100, 1000, 8000])
+def test_tone_lands_in_its_band(frequency):
+    analyser = leds.AudioAnalyser('unused')
+    analyser.feed(tone(frequency, analyser.window_size), 0)
+    arrived, levels = analyser.spectrum
+    bin_width = analyser.sample_rate / analyser.window_size
+    band = np.searchsorted(analyser.edges, round(frequency / bin_width), side='right') - 1
+    assert np.argmax(levels) == band
+    assert levels[band] == 1
+
+
+def test_analysed_every_hop():
+    analyser = leds.AudioAnalyser('unused')
+    samples = tone(1000, analyser.hop - 1)
+    analyser.feed(samples, 1)
+    assert analyser.spectrum is None
+    analyser.feed(samples[:1], 2)
+    assert analyser.spectrum[0] == 2
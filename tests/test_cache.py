@@ -0,0 +1,81 @@
+import threading
+import time
+
+import numpy as np
+
+import leds
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+def rainbow(pixel_count=100):
+    program = leds.Rainbow(leds.Frame(pixel_count))
+    program.prepare()
+    return program
+
+
+def test_runs_live_until_the_recording_is_ready(tmp_path):
+    cache = leds.AnimationCache(str(tmp_path))
+    program = rainbow()
+    engine = leds.RainbowEngine(100)
+    steps = cache.playback(program)
+    for i in range(400):
+        assert next(steps) == program.interval
+        np.testing.assert_array_equal(program.frame.data2, engine.row(i % 360))
+        if i == 10:
+            wait_for(lambda: not cache.recording)
+    steps.close()
+    assert cache.key(program) in cache.mapped
+    assert len(list(tmp_path.glob('*.bin'))) == 1
+
+
+def test_parameter_change_does_not_wait_for_recording(tmp_path, monkeypatch):
+    cache = leds.AnimationCache(str(tmp_path))
+    program = rainbow()
+    steps = cache.playback(program)
+    next(steps)
+    wait_for(lambda: not cache.recording)
+
+    release = threading.Event()
+    record_file = cache.record_file
+
+    def slow_record_file(*args):
+        release.wait()
+        record_file(*args)
+    monkeypatch.setattr(cache, 'record_file', slow_record_file)
+
+    program.speed = 2
+    engine = leds.RainbowEngine(100)
+    for hue in range(1, 6):
+        next(steps)
+        # live frames at the new speed while the recording is held up, the
+        # program carrying on from the one frame it ran before its recording
+        np.testing.assert_array_equal(program.frame.data2, engine.row(hue, speed=2))
+    assert cache.key(program) not in cache.mapped
+    release.set()
+    wait_for(lambda: not cache.recording)
+    next(steps)
+    assert cache.key(program) in cache.mapped
+    steps.close()
+
+
+def test_failed_recording_keeps_running_live(tmp_path, monkeypatch):
+    cache = leds.AnimationCache(str(tmp_path))
+
+    def broken(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(cache, 'record_file', broken)
+    program = rainbow()
+    steps = cache.playback(program)
+    next(steps)
+    wait_for(lambda: not cache.recording)
+    for i in range(3):
+        next(steps)
+    assert cache.failed == {cache.key(program)}
+    assert not cache.mapped
+    steps.close()
@@ -0,0 +1,94 @@
+import errno
+import logging
+import socket
+import time
+
+import numpy as np
+
+import leds
+
+
+class FakeSocket:
+    """Accepts only max_groups multicast memberships, like Linux's default of 20."""
+    def __init__(self, max_groups=20):
+        self.max_groups = max_groups
+        self.groups = []
+
+    def setsockopt(self, level, option, value):
+        if option != socket.IP_ADD_MEMBERSHIP:
+            return
+        if len(self.groups) >= self.max_groups:
+            raise OSError(errno.ENOBUFS, "No buffer space available")
+        self.groups.append(socket.inet_ntoa(value[:4]))
+
+
+def e131(pixel_count, monkeypatch, sock):
+    monkeypatch.setattr(leds.ServerProgram, 'open_socket', lambda self: sock)
+    return leds.E131Program(leds.Frame(pixel_count))
+
+
+def test_multicast_joined_for_each_universe(monkeypatch):
+    sock = FakeSocket()
+    program = e131(776, monkeypatch, sock)
+    assert program.open_socket() is sock
+    assert sock.groups == ['239.255.0.{}'.format(universe) for universe in range(1, 6)]
+
+
+def test_universes_beyond_the_membership_limit_are_unicast(monkeypatch, caplog):
+    sock = FakeSocket()
+    program = e131(170 * 25, monkeypatch, sock)
+    with caplog.at_level(logging.WARNING):
+        assert program.open_socket() is sock
+    assert len(sock.groups) == 20
+    message, = [record.getMessage() for record in caplog.records]
+    assert 'universes 21, 22, 23, 24, 25 will only be received by unicast' in message
+    assert 'limit on multicast memberships' in message
+
+
+def test_universes_are_drawn_in_order(monkeypatch):
+    program = e131(340, monkeypatch, FakeSocket())
+    channels = np.arange(510, dtype=np.uint8).tobytes()
+    assert program.handle_packet(leds.E131Program.packet(2, 1, channels))
+    assert program.handle_packet(leds.E131Program.packet(1, 1, channels))
+    expected = leds.decode_rgb(channels)
+    np.testing.assert_array_equal(program.frame.data, np.concatenate([expected, expected]))
+
+
+def test_synchronised_universes_wait_for_sync(monkeypatch):
+    program = e131(340, monkeypatch, FakeSocket())
+    channels = bytes([255, 0, 0]) * 170
+    assert not program.handle_packet(leds.E131Program.packet(1, 1, channels, sync_address=7))
+    assert not program.handle_packet(leds.E131Program.packet(2, 1, channels, sync_address=7))
+    assert not program.handle_packet(leds.E131Program.sync_packet(1, 8))
+    assert program.handle_packet(leds.E131Program.sync_packet(1, 7))
+    assert not program.handle_packet(leds.E131Program.sync_packet(2, 7))
+
+
+def test_artnet_universes():
+    program = leds.ArtNetProgram(leds.Frame(340))
+    channels = bytes([0, 0, 255]) * 170
+    assert program.handle_packet(leds.ArtNetProgram.packet(1, 1, channels))
+    assert not program.frame.data[:170].any()
+    assert (program.frame.data[170:] == leds.rgb_to_24bit(0, 0, 255)).all()
+
+
+def test_receivers_draw_layers_of_their_own(monkeypatch):
+    monkeypatch.setattr(leds.ServerProgram, 'open_socket', lambda self: FakeSocket())
+    layers = [leds.Frame(170, timeout=1, priority=2, fade=0.5) for i in range(2)]
+    e131, artnet = leds.E131Program(layers[0]), leds.ArtNetProgram(layers[1])
+    renderer = leds.Renderer(leds.RecordingBackend(170))
+    renderer.frames = list(layers)
+    red, blue = bytes([255, 0, 0]) * 170, bytes([0, 0, 255]) * 170
+    for program, packet in ((e131, leds.E131Program.packet(1, 1, red)),
+                            (artnet, leds.ArtNetProgram.packet(0, 1, blue))):
+        assert program.handle_packet(packet)
+        program.show()
+    now = time.monotonic()
+    with leds.render_condition:
+        assert renderer.render(now)
+    assert (renderer.backend.data == leds.rgb_to_24bit(255, 0, 0)).all()
+    # once the E1.31 layer has faded the Art-Net one shows, untouched by it
+    layers[0].last_write = now - 2
+    with leds.render_condition:
+        assert renderer.render(now)
+    assert (renderer.backend.data == leds.rgb_to_24bit(0, 0, 255)).all()
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import leds
+
+
+class FakeProcess:
+    def __init__(self, alive):
+        self.alive = alive
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+
+@pytest.fixture
+def shared():
+    shared = leds.SharedFrame(10)
+    yield shared
+    shared.close()
+    shared.unlink()
+
+
+def test_read_copies_the_published_span(shared):
+    into = np.zeros(10, dtype=np.uint32)
+    shared.publish(np.arange(10, dtype=np.uint32), 2, 5)
+    assert shared.read(into, 0) == (2, 2, 5)
+    np.testing.assert_array_equal(into, [0, 0, 2, 3, 4, 0, 0, 0, 0, 0])
+    assert shared.read(into, 2) == (2, 0, 0)
+
+
+def test_read_gives_up_on_a_writer_that_died_mid_publish(shared):
+    into = np.zeros(10, dtype=np.uint32)
+    shared.sequence[0] = 3
+    started = time.monotonic()
+    assert shared.read(into, 0, timeout=10, alive=lambda: False) is None
+    assert shared.read(into, 0, timeout=0.05) is None
+    assert time.monotonic() - started < 1
+
+
+def isolated(shared, alive):
+    program = leds.Rainbow(leds.Frame(10))
+    runner = leds.IsolatedProgram(program)
+    runner.shared = shared
+    runner.staging = np.zeros(10, dtype=np.uint32)
+    runner.sequence = 0
+    runner.process = FakeProcess(alive)
+    return runner
+
+
+def test_present_shows_the_published_frame(shared):
+    runner = isolated(shared, True)
+    shared.publish(np.full(10, 7, dtype=np.uint32), 0, 10)
+    assert runner.present()
+    np.testing.assert_array_equal(runner.program.frame.data2, [7] * 10)
+
+
+def test_torn_frame_fails_the_present_without_blocking_stop(shared):
+    runner = isolated(shared, False)
+    shared.sequence[0] = 1
+    assert not runner.present()
+    stopper = threading.Thread(target=runner.stop)
+    stopper.start()
+    stopper.join(1)
+    assert not stopper.is_alive()
+    assert not runner.program.frame.data2.any()
@@ -0,0 +1,51 @@
+import numpy as np
+
+import leds
+
+red = leds.rgb_to_24bit(255, 0, 0)
+green = leds.rgb_to_24bit(0, 255, 0)
+
+
+def picker(pixel_count=10):
+    program = leds.PixelPicker(leds.Frame(pixel_count, timeout=1))
+    program.prepare()
+    return program
+
+
+def test_parse_single_pixels_and_ranges():
+    pixels, colours = leds.PixelPicker.parse({'3': [255, 0, 0], '5-7': [0, 255, 0]})
+    np.testing.assert_array_equal(pixels, [3, 5, 6, 7])
+    np.testing.assert_array_equal(colours, [red, green, green, green])
+
+
+def test_parse_range_of_colours():
+    pixels, colours = leds.PixelPicker.parse({'0-1': [[255, 0, 0], [0, 255, 0]]})
+    np.testing.assert_array_equal(pixels, [0, 1])
+    np.testing.assert_array_equal(colours, [red, green])
+
+
+def test_parse_negative_keys():
+    pixels, colours = leds.PixelPicker.parse({'-1': [255, 0, 0], -2: [255, 0, 0]})
+    np.testing.assert_array_equal(pixels, [-1, -2])
+    pixels, colours = leds.PixelPicker.parse({'-2-1': [0, 255, 0]})
+    np.testing.assert_array_equal(pixels, [-2, -1, 0, 1])
+
+
+def test_out_of_range_pixels_are_ignored():
+    program = picker()
+    steps = program.steps()
+    program.post({'-1': [255, 0, 0], '-2-1': [0, 255, 0], '9-12': [255, 0, 0]})
+    next(steps)
+    np.testing.assert_array_equal(program.frame.data2, [green, green] + [0] * 7 + [red])
+
+
+def test_shown_every_frame_without_updates():
+    program = picker()
+    steps = program.steps()
+    program.post([[255, 0, 0]])
+    next(steps)
+    for i in range(3):
+        program.frame.last_write = 0
+        next(steps)
+        assert program.frame.last_write > 0
+    assert program.frame.data2[0] == red
@@ -0,0 +1,87 @@
+import json
+import os
+
+import pytest
+
+import leds
+
+
+@pytest.fixture
+def library(tmp_path):
+    return leds.PresetLibrary(leds.Frame(10), {
+        'rainbow': leds.PresetDefinition(leds.Rainbow),
+    }, str(tmp_path))
+
+
+def write(library, name, data):
+    path = os.path.join(library.path, name + '.json')
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+
+def test_file_presets_are_loaded(library):
+    write(library, 'chase', {'program': 'Chase', 'kwargs': {'n': 7}, 'zone': 'projector'})
+    library.refresh()
+    program = library['chase']
+    assert isinstance(program, leds.Chase)
+    assert program.kwargs == {'n': 7}
+    assert program.zone == 'projector'
+
+
+@pytest.mark.parametrize('name', ['ServerProgram', 'E131Program', 'ArtNetProgram',
+                                  'DmxProgram', 'LedProgram', 'Frame', 'os', 'Nothing'])
+def test_only_animation_programs_are_accepted(library, name):
+    path = write(library, 'bad', {'program': name})
+    with pytest.raises(ValueError):
+        library.parse(path)
+    library.refresh()
+    assert 'bad' not in library
+
+
+def test_rejected_file_leaves_the_builtin(library):
+    write(library, 'rainbow', {'program': 'ServerProgram'})
+    library.refresh()
+    assert library.definitions['rainbow'].program is leds.Rainbow
+
+
+def test_removed_file_restores_the_builtin(library):
+    path = write(library, 'rainbow', {'program': 'Chase'})
+    library.refresh()
+    assert isinstance(library['rainbow'], leds.Chase)
+    changes = []
+    library.listeners.append(changes.append)
+    os.remove(path)
+    library.refresh()
+    assert isinstance(library['rainbow'], leds.Rainbow)
+    assert list(changes[0]) == ['rainbow']
+
+
+def test_parameters_are_set_after_setup(library):
+    write(library, 'fast', {'program': 'Rainbow', 'parameters': {'speed': 3}})
+    write(library, 'wide', {'program': 'Chase', 'parameters': {'pixels': 9}})
+    library.refresh()
+    program = library['fast']
+    program.prepare()
+    assert program.speed == 3.0
+    # and again on reselection, which runs setup() afresh
+    program.speed = 1
+    program.prepare()
+    assert program.speed == 3.0
+    chase = library['wide']
+    chase.prepare()
+    assert chase.n == 9
+
+
+@pytest.mark.parametrize('data', [
+    {'program': 'Rainbow', 'parameters': {'colour': 1}},
+    {'program': 'Rainbow', 'parameters': {'speed': 'fast'}},
+    {'program': 'Rainbow', 'parameter': {'speed': 2}},
+    {'program': 'Rainbow', 'zone': 'nowhere'},
+])
+def test_bad_files_are_rejected(library, data):
+    path = write(library, 'bad', data)
+    with pytest.raises((ValueError, KeyError)):
+        library.parse(path)
+    library.refresh()
+    assert 'bad' not in library
@@ -0,0 +1,119 @@
+import colorsys
+import math
+
+import numpy as np
+import pytest
+
+import leds
+
+
+def reference_pixel(hue, pixel, pixel_count, speed=1, multiplier=2, divisor=1):
+    """A pixel as the original per-pixel colorsys rainbow computed it."""
+    scaling = 360.0/pixel_count * multiplier
+    hue2 = ((hue*speed)+(pixel*scaling)) % 360
+    (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
+    return leds.rgb_to_24bit(int(r*255/divisor), int(g*255/divisor), int(b*255/divisor))
+
+
+def reference_frame(hue, pixel_count, speed=1, multiplier=2, divisor=1):
+    return np.array([reference_pixel(hue, pixel, pixel_count, speed, multiplier, divisor)
+                     for pixel in range(pixel_count)], dtype=np.uint32)
+
+
+def run_frames(program, count):
+    """Step a program through count frames, returning a copy of each."""
+    frames = []
+    steps = program.steps()
+    for i in range(count):
+        next(steps)
+        frames.append(program.frame.data2.copy())
+    steps.close()
+    return frames
+
+
+@pytest.mark.parametrize('pixel_count', [1, 7, 150, 776, 1000])
+@pytest.mark.parametrize('speed', [1, 2, 0.5, 3.7])
+@pytest.mark.parametrize('multiplier', [2, 1, 0.3])
+@pytest.mark.parametrize('divisor', [1, 5])
+def test_engine_matches_colorsys(pixel_count, speed, multiplier, divisor):
+    engine = leds.RainbowEngine(pixel_count)
+    for hue in list(range(0, 360, 23)) + [359]:
+        expected = reference_frame(hue, pixel_count, speed, multiplier, divisor)
+        np.testing.assert_array_equal(engine.row(hue, speed, multiplier, divisor), expected)
+
+
+def test_engine_rebuilds_when_parameters_change():
+    engine = leds.RainbowEngine(100)
+    engine.row(10, speed=1)
+    np.testing.assert_array_equal(engine.row(10, speed=2), reference_frame(10, 100, speed=2))
+
+
+def test_rainbow_frames():
+    program = leds.Rainbow(leds.Frame(300))
+    for hue, frame in enumerate(run_frames(program, 5)):
+        np.testing.assert_array_equal(frame, reference_frame(hue, 300))
+
+
+def test_rainbow_speed_change_between_frames():
+    program = leds.Rainbow(leds.Frame(300))
+    steps = program.steps()
+    next(steps)
+    program.speed = 3.5
+    program.multiplier = 1.5
+    next(steps)
+    np.testing.assert_array_equal(program.frame.data2,
+                                  reference_frame(1, 300, speed=3.5, multiplier=1.5))
+    steps.close()
+
+
+def test_dim_rainbow_frames():
+    program = leds.DimRainbow(leds.Frame(300))
+    for hue, frame in enumerate(run_frames(program, 5)):
+        np.testing.assert_array_equal(frame, reference_frame(hue, 300, divisor=5))
+
+
+@pytest.mark.parametrize('rheostat', [b'0', b'12.5', b'50', b'100', b'-3'])
+def test_bercostat_bow_frames(rheostat):
+    program = leds.BercostatBow(leds.Frame(776))
+    program.prepare()
+    leds.sensors.update(leds.Bercostat.rheostat_topic, rheostat)
+    chosen_pixel = math.floor(float(rheostat) * 7.76)
+    for hue, frame in enumerate(run_frames(program, 3)):
+        expected = reference_frame(hue, 776)
+        expected[np.arange(776) > chosen_pixel] = 0
+        np.testing.assert_array_equal(frame, expected)
+
+
+def test_programs_share_one_engine_per_size():
+    programs = [leds.Rainbow(leds.Frame(123)), leds.DimRainbow(leds.Frame(123)),
+                leds.ProjectorBow(leds.Frame(123)), leds.BercostatBow(leds.Frame(123))]
+    for program in programs:
+        program.prepare()
+    assert len({id(program.rainbow) for program in programs}) == 1
+    assert programs[0].rainbow is leds.RainbowEngine.shared(123)
+    assert programs[0].rainbow is not leds.RainbowEngine.shared(124)
+
+
+def test_switching_programs_reuses_their_tables():
+    rainbow = leds.Rainbow(leds.Frame(321))
+    dim = leds.DimRainbow(leds.Frame(321))
+    run_frames(rainbow, 3)
+    run_frames(dim, 3)
+    table, built = rainbow.rainbow.table((1, 2, 1))
+    assert built[:3].all()
+    # prepare() on the switch back finds the rows already built
+    frames = run_frames(rainbow, 3)
+    assert rainbow.rainbow.table((1, 2, 1))[0] is table
+    for hue, frame in enumerate(frames):
+        np.testing.assert_array_equal(frame, reference_frame(hue, 321))
+
+
+def test_tables_beyond_max_bytes_are_dropped(monkeypatch):
+    engine = leds.RainbowEngine(1000)
+    monkeypatch.setattr(engine, 'max_bytes', 3 * 360 * 1000 * 4)
+    for divisor in range(1, 6):
+        engine.row(0, divisor=divisor)
+    assert list(engine.tables) == [(1, 2, 3), (1, 2, 4), (1, 2, 5)]
+    monkeypatch.setattr(engine, 'max_bytes', 0)
+    np.testing.assert_array_equal(engine.row(7), reference_frame(7, 1000))
+    assert list(engine.tables) == [(1, 2, 1)]
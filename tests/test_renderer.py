@@ -0,0 +1,83 @@
+import numpy as np
+
+import leds
+
+
+def render(renderer, now):
+    with leds.render_condition:
+        rendered = renderer.render(now)
+    if rendered:
+        renderer.backend.show()
+    return rendered
+
+
+def shown_at(frame, now):
+    frame.show()
+    frame.last_write = now
+
+
+def test_strip_is_cleared_when_the_last_layer_fades_out():
+    frame = leds.Frame(10, timeout=1, fade=0.5)
+    renderer = leds.Renderer(leds.RecordingBackend(10))
+    renderer.frames = [frame]
+    frame.set_all(leds.rgb_to_24bit(255, 255, 255))
+    shown_at(frame, 100)
+    assert render(renderer, 100)
+    assert renderer.backend.data.all()
+    # partway through the fade, then the last step before it's gone
+    assert render(renderer, 101.25)
+    assert render(renderer, 101.48)
+    assert renderer.backend.data.any()
+    assert render(renderer, 101.5)
+    assert not renderer.backend.data.any()
+    # and only the once
+    assert not render(renderer, 101.6)
+
+
+def test_lower_layer_shows_through_when_the_top_fades_out():
+    main = leds.Frame(10)
+    top = leds.Frame(10, timeout=1, priority=1, fade=0.5)
+    renderer = leds.Renderer(leds.RecordingBackend(10))
+    renderer.frames = [top, main]
+    main.set_all(leds.rgb_to_24bit(0, 0, 255))
+    main.show()
+    top.set_all(leds.rgb_to_24bit(255, 0, 0))
+    shown_at(top, 100)
+    assert render(renderer, 100)
+    assert render(renderer, 101.5)
+    np.testing.assert_array_equal(renderer.backend.data, leds.correct_colours(main.data2))
+
+
+def test_nothing_is_written_before_anything_is_shown():
+    renderer = leds.Renderer(leds.RecordingBackend(10))
+    renderer.frames = [leds.Frame(10, timeout=1)]
+    assert not render(renderer, 100)
+
+
+def test_render_counters_are_in_the_telemetry_snapshot():
+    frame = leds.Frame(10)
+    renderer = leds.Renderer(leds.RecordingBackend(10))
+    renderer.frames = [frame]
+    frame.set_all(leds.rgb_to_24bit(1, 2, 3))
+    frame.show()
+    render(renderer, 100)
+    frame.set_pixel(0, leds.rgb_to_24bit(1, 2, 3))
+    frame.show()
+    frame.set_pixel(0, leds.rgb_to_24bit(4, 5, 6))
+    frame.show()
+    render(renderer, 100)
+    stats = leds.telemetry.snapshot(1)
+    assert stats['render'] == {'frames': 2, 'pixels': 11, 'skipped': [1]}
+
+
+def test_frame_resized_to_the_outputs():
+    frame = leds.Frame(776, timeout=5)
+    frame.resize(1000)
+    program = leds.Rainbow(frame)
+    renderer = leds.Renderer(leds.RecordingBackend(1000))
+    renderer.frames = [frame]
+    steps = program.steps()
+    next(steps)
+    steps.close()
+    assert render(renderer, frame.last_write)
+    np.testing.assert_array_equal(renderer.backend.data, leds.RainbowEngine(1000).row(0))
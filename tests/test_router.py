@@ -0,0 +1,107 @@
+import collections
+import itertools
+import time
+
+import pytest
+
+import leds
+
+Message = collections.namedtuple('Message', 'topic payload')
+prefix = leds.MessageHandler.prefix
+
+
+class FakeWorker:
+    """Stands in for MainLedThread, noting the jobs it is given."""
+    def __init__(self):
+        self.program = None
+        self.posted = []
+        self.updates = []
+
+    def post(self, program):
+        self.posted.append(program)
+
+    def update(self, program, name, value):
+        self.updates.append((program, name, value))
+
+
+def fake_source(topics, count):
+    """count messages cycling through (topic, payload) pairs."""
+    for topic, payload in itertools.islice(itertools.cycle(topics), count):
+        yield Message(prefix + '/' + topic if topic else prefix, payload)
+
+
+@pytest.fixture
+def library():
+    return leds.PresetLibrary(leds.Frame(10), {
+        'rainbow': leds.PresetDefinition(leds.Rainbow),
+        'chase': leds.PresetDefinition(leds.Chase, kwargs={'n': 3}),
+    })
+
+
+@pytest.fixture
+def worker():
+    return FakeWorker()
+
+
+@pytest.fixture
+def dispatch(library, worker):
+    handler = leds.MessageHandler(worker, library)
+
+    def dispatch(*messages):
+        for message in messages:
+            handler.on_message(None, None, message)
+    return dispatch
+
+
+def test_preset_selected_by_name(library, worker, dispatch):
+    dispatch(*fake_source([('', b'rainbow'), ('', b'"chase"')], 2))
+    assert worker.posted == [library['rainbow'], library['chase']]
+
+
+def test_colour_selects_a_static_colour(worker, dispatch):
+    dispatch(*fake_source([('', b'red')], 1))
+    program, = worker.posted
+    assert isinstance(program, leds.StaticColour)
+    assert program.args == (leds.rgb_to_24bit(255, 0, 0),)
+
+
+def test_parameters_and_aliases(library, worker, dispatch):
+    dispatch(*fake_source([('rainbow/speed', b'2.5'), ('chase/n', b'7'),
+                           ('chase/pixels', b'9')], 3))
+    assert worker.updates == [(library['rainbow'], 'speed', 2.5),
+                              (library['chase'], 'n', 7),
+                              (library['chase'], 'n', 9)]
+
+
+def test_bad_and_unknown_messages_are_ignored(worker, dispatch):
+    dispatch(*fake_source([('rainbow/speed', b'fast'), ('chase/n', b'\xff'),
+                           ('nothing/here', b'1'), ('stats', b'{}'), ('', b'nonsense')], 5))
+    assert worker.updates == []
+    assert worker.posted == []
+
+
+def test_brightness(dispatch, monkeypatch):
+    levels = []
+    monkeypatch.setattr(leds, 'set_brightness', levels.append)
+    dispatch(*fake_source([('brightness', b'40'), ('brightness', b'101')], 2))
+    assert levels == [40]
+
+
+def test_routes_rebuilt_when_presets_change(library, worker, dispatch):
+    library.definitions['zap'] = leds.PresetDefinition(leds.Chase)
+    for listener in library.listeners:
+        listener({'zap': None})
+    dispatch(*fake_source([('zap/speed', b'3')], 1))
+    assert worker.updates == [(library['zap'], 'speed', 3.0)]
+
+
+def test_dispatch_throughput(worker, dispatch):
+    count = 50000
+    messages = list(fake_source([('rainbow/speed', b'2'), ('chase/n', b'4'),
+                                 ('nothing/here', b'1'), ('stats', b'{}')], count))
+    started = time.perf_counter()
+    dispatch(*messages)
+    elapsed = time.perf_counter() - started
+    assert len(worker.updates) == count // 2
+    # comfortably beyond any broker, with headroom for slow CI machines
+    assert count / elapsed > 20000
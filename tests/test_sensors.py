@@ -0,0 +1,106 @@
+import collections
+import math
+import threading
+import time
+
+import leds
+
+Message = collections.namedtuple('Message', 'topic payload')
+topic = leds.Bercostat.rheostat_topic
+
+
+class FakeClient:
+    def __init__(self):
+        self.topics = []
+
+    def subscribe(self, topic):
+        self.topics.append(topic)
+
+
+class SlowBroker(threading.Thread):
+    """Delivers rheostat readings to the handler, latency seconds apart."""
+    def __init__(self, handler, latency):
+        super().__init__(daemon=True)
+        self.handler = handler
+        self.latency = latency
+        self.delivered = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.latency):
+            self.delivered += 1
+            value = str(self.delivered % 100).encode()
+            self.handler.on_message(None, None, Message(topic, value))
+
+
+def handler():
+    return leds.MessageHandler(None, leds.PresetLibrary(leds.Frame(10), {}))
+
+
+def frames_in(program, seconds):
+    """Step program as MainLedThread would for seconds, returning the frame count."""
+    steps = program.steps()
+    clock = leds.FrameClock()
+    end = time.monotonic() + seconds
+    frames = 0
+    while time.monotonic() < end:
+        interval = next(steps)
+        frames += 1
+        time.sleep(max(0, clock.next_deadline(interval) - time.monotonic()))
+    steps.close()
+    return frames
+
+
+def test_topics_are_subscribed_on_connect_and_reconnect():
+    sensors = leds.SensorInputs()
+    sensors.subscribe('sensor/a')
+    client = FakeClient()
+    sensors.connected(client)
+    sensors.subscribe('sensor/b')
+    sensors.subscribe('sensor/b')
+    assert client.topics == ['sensor/a', 'sensor/b']
+    reconnected = FakeClient()
+    sensors.connected(reconnected)
+    assert reconnected.topics == ['sensor/a', 'sensor/b']
+
+
+def test_sensor_messages_are_cached_not_routed():
+    leds.sensors.subscribe(topic)
+    handler().on_message(None, None, Message(topic, b'42.5'))
+    assert leds.sensors.get_float(topic) == 42.5
+
+
+def test_undecodable_sensor_payload_is_logged_not_raised():
+    leds.sensors.subscribe(topic)
+    handler().on_message(None, None, Message(topic, b'\xff'))
+
+
+def test_frame_rate_is_independent_of_broker_latency():
+    rates = {}
+    for latency in (0.001, 0.3, 2):
+        program = leds.BercostatBow(leds.Frame(776))
+        program.prepare()
+        broker = SlowBroker(handler(), latency)
+        broker.start()
+        try:
+            rates[latency] = frames_in(program, 1)
+        finally:
+            broker.stopped.set()
+            broker.join()
+    # 25 fps, whether readings arrive every millisecond or not at all
+    for latency, frames in rates.items():
+        assert frames >= 20, rates
+
+
+def test_bar_follows_the_latest_reading():
+    program = leds.BercostatBow(leds.Frame(776))
+    program.prepare()
+    steps = program.steps()
+    connection = handler()
+    for reading in (10, 50, 3):
+        connection.on_message(None, None, Message(topic, str(reading).encode()))
+        next(steps)
+        lit = math.floor(reading * 7.76) + 1
+        assert program.frame.data2[:lit].all()
+        assert not program.frame.data2[lit:].any()
+    steps.close()
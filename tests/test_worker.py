@@ -0,0 +1,84 @@
+import threading
+import time
+
+import leds
+
+
+def start_worker():
+    worker = leds.MainLedThread()
+    worker.daemon = True
+    worker.start()
+    return worker
+
+
+def wait_for(condition, timeout=2):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_queue_drains_under_hundreds_of_changes_per_second():
+    frame = leds.Frame(776)
+    programs = [leds.Rainbow(frame), leds.DimRainbow(frame), leds.Chase(frame)]
+    rainbow = programs[0]
+    worker = start_worker()
+    stop = threading.Event()
+    posted = []
+    backlog = []
+
+    def poster(n):
+        count = 0
+        while not stop.is_set():
+            worker.post(programs[(count + n) % len(programs)])
+            worker.update(rainbow, 'speed', 1 + count % 3)
+            count += 2
+            time.sleep(0.004)
+        posted.append(count)
+
+    def monitor():
+        while not stop.is_set():
+            backlog.append(worker.task_queue.qsize())
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=poster, args=(n,)) for n in range(4)]
+    threads.append(threading.Thread(target=monitor))
+    for thread in threads:
+        thread.start()
+    time.sleep(1.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert sum(posted) / 1.5 >= 400
+    assert wait_for(lambda: worker.task_queue.qsize() == 0)
+    # kept up throughout rather than catching up afterwards
+    assert max(backlog) < 100
+
+    worker.post(rainbow)
+    worker.update(rainbow, 'speed', 2)
+    assert wait_for(lambda: worker.program is rainbow and rainbow.speed == 2)
+    frames = rainbow.clock.frames
+    assert wait_for(lambda: rainbow.clock.frames > frames + 2)
+
+    # a program that finishes straight away leaves the worker idle
+    worker.post(leds.LedProgram(frame))
+    assert wait_for(lambda: worker.program is None)
+
+
+def test_jobs_run_in_order_between_frames():
+    frame = leds.Frame(100)
+    program = leds.Rainbow(frame)
+    worker = start_worker()
+    worker.post(program)
+    values = list(range(500))
+    seen = []
+    for value in values:
+        worker.update(program, 'multiplier', value)
+        worker.queue_job(lambda: seen.append(program.multiplier))
+    assert wait_for(lambda: len(seen) == len(values))
+    assert seen == values
+    worker.post(leds.LedProgram(frame))
+    assert wait_for(lambda: worker.program is None)
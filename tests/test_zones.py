@@ -0,0 +1,83 @@
+import colorsys
+
+import numpy as np
+import pytest
+
+import leds
+
+
+def in_projector(pixel):
+    """The branch ProjectorBow used before zones."""
+    return pixel >= 0 and (pixel <= 386 or pixel >= 505)
+
+
+def old_projector_bow(hue, pixel_count, speed=1, multiplier=2):
+    """A ProjectorBow frame as the original per-pixel loop drew it."""
+    scaling = 360.0/pixel_count * multiplier
+    frame = np.zeros(pixel_count, dtype=np.uint32)
+    for pixel in range(0, pixel_count):
+        if in_projector(pixel):
+            hue2 = ((hue*speed)+(pixel*scaling)) % 360
+            (r, g, b) = colorsys.hsv_to_rgb(hue2/360.0, 1.0, 1.0)
+            frame[pixel] = leds.rgb_to_24bit(int(r*255), int(g*255), int(b*255))
+    return frame
+
+
+def old_mask(pixel_count):
+    return np.array([in_projector(pixel) for pixel in range(pixel_count)])
+
+
+def test_projector_bow_matches_the_old_branch():
+    program = leds.ProjectorBow(leds.Frame(776))
+    steps = program.steps()
+    for hue in range(360):
+        next(steps)
+        if hue % 17 == 0 or hue == 359:
+            np.testing.assert_array_equal(program.frame.data2, old_projector_bow(hue, 776))
+    steps.close()
+
+
+@pytest.mark.parametrize('pixel_count', [1, 386, 387, 388, 504, 505, 506, 776, 1000])
+def test_zones_match_the_old_branch(pixel_count):
+    inside = old_mask(pixel_count)
+    colour = leds.rgb_to_24bit(10, 20, 30)
+
+    frame = leds.Frame(pixel_count)
+    frame.set_zone('projector', colour)
+    np.testing.assert_array_equal(frame.data, np.where(inside, colour, 0))
+
+    frame = leds.Frame(pixel_count)
+    frame.set_zone('projector gap', colour)
+    np.testing.assert_array_equal(frame.data, np.where(inside, 0, colour))
+
+    frame = leds.Frame(pixel_count)
+    frame.set_all(colour)
+    frame.clear_outside('projector')
+    np.testing.assert_array_equal(frame.data, np.where(inside, colour, 0))
+
+
+def test_zone_from_an_array_of_colours():
+    colours = np.arange(776, dtype=np.uint32) + 1
+    frame = leds.Frame(776)
+    frame.set_zone('projector', colours)
+    np.testing.assert_array_equal(frame.data, np.where(old_mask(776), colours, 0))
+
+
+def test_program_kept_inside_its_zone():
+    program = leds.Rainbow(leds.Frame(776), zone='projector')
+    steps = program.steps()
+    next(steps)
+    steps.close()
+    expected = leds.RainbowEngine(776).row(0)
+    np.testing.assert_array_equal(program.frame.data2, np.where(old_mask(776), expected, 0))
+
+
+def test_loaded_zones_replace_the_builtins(tmp_path, monkeypatch):
+    monkeypatch.setattr(leds, 'zones', dict(leds.zones))
+    path = tmp_path / 'zones.json'
+    path.write_text('{"projector": [[0, 10], [20, null]], "middle": [[10, 20]]}')
+    leds.load_zones(str(path))
+    frame = leds.Frame(30)
+    frame.set_zone('middle', 1)
+    frame.set_zone('projector', 2)
+    np.testing.assert_array_equal(frame.data, [2] * 10 + [1] * 10 + [2] * 10)